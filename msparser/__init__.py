@@ -0,0 +1,906 @@
+# Copyright (c) 2011 Mathieu Turcotte
+# Licensed under the MIT license.
+
+"""
+The msparser module offers a simple interface to parse the Valgrind massif.out
+file format, i.e. data files produced the Valgrind heap profiler.
+"""
+
+from __future__ import with_statement  # Enable with statement in Python 2.5.
+import bisect
+import os.path
+import sys
+
+# The native scanner is optional, fall back on the pure Python implementation
+# when it hasn't been built.
+try:
+    from msparser import _speedups
+except ImportError:
+    _speedups = None
+
+__all__ = ["parse", "parse_file", "merge", "leak_suspects", "Profile",
+           "ParseError"]
+
+
+class _LazyRegex:
+    """
+    A regex compiled on first use, which keeps the module cheap to import.
+    Compiling it stores its match method on the instance, so that later calls
+    don't go through this class anymore.
+    """
+    def __init__(self, pattern, verbose=False):
+        self.pattern = pattern
+        self._verbose = verbose
+
+    def __getattr__(self, name):
+        import re
+        flags = 0
+        if self._verbose:
+            flags = re.VERBOSE
+        regex = re.compile(self.pattern, flags)
+        self.match = regex.match
+        return getattr(regex, name)
+
+
+# All the regexes below are compiled lazily, see _LazyRegex.
+
+# Regex used to parse comments.
+_COMMENT_RE = _LazyRegex(r"\s*(#|$)")
+
+# Regexes used to parse header fields.
+_FIELD_DESC_RE = _LazyRegex(r"desc:\s(?P<data>.*)$")
+_FIELD_CMD_RE = _LazyRegex(r"cmd:\s(?P<data>.*)$")
+_FIELD_TIME_UNIT_RE = _LazyRegex(r"time_unit:\s(?P<data>ms|B|i)$")
+
+# Regexes used to parse snaphot fields.
+_FIELD_SNAPSHOT_RE = _LazyRegex(r"snapshot=(?P<data>\d+)")
+_FIELD_TIME_RE = _LazyRegex(r"time=(?P<data>\d+)")
+_FIELD_MEM_HEAP_RE = _LazyRegex(r"mem_heap_B=(?P<data>\d+)")
+_FIELD_MEM_EXTRA_RE = _LazyRegex(r"mem_heap_extra_B=(?P<data>\d+)")
+_FIELD_MEM_STACK_RE = _LazyRegex(r"mem_stacks_B=(?P<data>\d+)")
+_FIELD_HEAP_TREE_RE = _LazyRegex(r"heap_tree=(?P<data>\w+)")
+
+# Regex to parse heap entries. Matches three things:
+#   - the number of children,
+#   - the number of bytes,
+#   - and the details section.
+_HEAP_ENTRY_RE = _LazyRegex(r"""
+    \s*n                    # skip zero or more spaces, then 'n'
+    (?P<num_children>\d+)   # match number of children, 1 or more digits
+    :\s                     # skip ':' and one space
+    (?P<num_bytes>\d+)      # match the number of bytes, 1 or more digits
+    \s                      # skip one space
+    (?P<details>.*)         # match the details
+""", verbose=True)
+
+# Regex to check if the details section is below threshold.
+_HEAP_BELOW_THRESHOLD_RE = _LazyRegex(r"""in.*places?.*""")
+
+# Regex to parse the details section of entries above threshold.
+# This should match four things:
+#   - the hexadecimal address,
+#   - the function name,
+#   - the file name or binary path, i.e. file.cpp or usr/local/bin/foo.so,
+#   - and a line number if present.
+# Last two parts are optional to handle entries without a file name or binary
+# path.
+_HEAP_DETAILS_RE = _LazyRegex(r"""
+    (?P<address>[a-fA-F0-9x]+)  # match the hexadecimal address
+    :\s                         # skip ': '
+    (?P<function>.+?)           # match the function's name, non-greedy
+    (?:                         # don't capture fname/line group
+        \s
+        \(
+        (?:in\s)?               # skip 'in ' if present
+        (?P<fname>[^:]+)        # match the file name
+        :?                      # skip ':', if present
+        (?P<line>\d+)?          # match the line number, if present
+        \)
+    )?                          # fname/line group is optional
+    $                           # should have reached the EOL
+""", verbose=True)
+
+
+class ParseContext:
+    """
+    A simple context for parsing. Dumbed down version of fileinput.
+    """
+    def __init__(self, fd):
+        self._fd = fd
+        self._line = 0
+
+    def line(self):
+        return self._line
+
+    def readline(self):
+        self._line += 1
+        return self._fd.readline()
+
+    def filename(self):
+        return os.path.abspath(self._fd.name)
+
+
+class _RecoveryContext:
+    """
+    A context wrapper remembering the last line read, which is needed to
+    resynchronize after an error, and rejecting a last line without newline,
+    which was cut off and could otherwise parse as a valid but wrong line.
+    Only used when recovering from errors so that parsing well formed files
+    doesn't pay for it.
+    """
+    def __init__(self, ctx):
+        self._ctx = ctx
+        self.last_line = None
+
+    def line(self):
+        return self._ctx.line()
+
+    def readline(self):
+        self.last_line = self._ctx.readline()
+        if self.last_line and not self.last_line.endswith("\n"):
+            raise ParseError("truncated line", self)
+        return self.last_line
+
+    def filename(self):
+        return self._ctx.filename()
+
+
+class Profile(dict):
+    """
+    The data returned by parse. It's a regular dictionary which also indexes
+    its snapshots by id and by time, for constant time lookups by id and
+    logarithmic time lookups by time. The indexes are built when the profile
+    is created and don't follow later changes to the snapshots list.
+    """
+    def __init__(self, mdata):
+        dict.__init__(self, mdata)
+        snapshots = self["snapshots"]
+
+        self._indices_by_id = {}
+        for (index, snapshot) in enumerate(snapshots):
+            self._indices_by_id[snapshot["id"]] = index
+
+        # Massif writes the snapshots in time order, in which case this sort
+        # runs in linear time. Snapshots sharing a time keep the file order.
+        self._indices_by_time = sorted(
+            range(len(snapshots)), key=lambda index: snapshots[index]["time"])
+        self.times = [snapshots[index]["time"]
+                      for index in self._indices_by_time]
+
+    def snapshot_by_id(self, snapshot_id):
+        """
+        Return the snapshot with the given id. Raises KeyError if there is no
+        such snapshot.
+        """
+        return self["snapshots"][self._indices_by_id[snapshot_id]]
+
+    def snapshot_at(self, time):
+        """
+        Return the snapshot nearest to time, or None if there is no snapshot.
+        On ties, the earlier time wins and among snapshots sharing the same
+        time, the last one is returned.
+        """
+        times = self.times
+        if not times:
+            return None
+
+        position = bisect.bisect_left(times, time)
+        if position == len(times) or (
+                position > 0 and
+                time - times[position - 1] <= times[position] - time):
+            nearest = times[position - 1]
+        else:
+            nearest = times[position]
+
+        position = bisect.bisect_right(times, nearest) - 1
+        return self["snapshots"][self._indices_by_time[position]]
+
+    def snapshots_between(self, start, end):
+        """
+        Return the list of snapshots whose time is between start and end,
+        both inclusive, in time order.
+        """
+        first = bisect.bisect_left(self.times, start)
+        last = bisect.bisect_right(self.times, end)
+        snapshots = self["snapshots"]
+        return [snapshots[index]
+                for index in self._indices_by_time[first:last]]
+
+
+class ParseError(Exception):
+    """
+    Error raised when a parsing error is encountered.
+    """
+    def __init__(self, msg, ctx):
+        self.msg = msg
+        self.line = ctx.line()
+        self.filename = ctx.filename()
+
+    def __str__(self):
+        return " ".join([str(self.msg), 'at line', str(self.line), 'in',
+                        str(self.filename)])
+
+    def __reduce__(self):
+        # The context is gone once the error has been raised, so errors sent
+        # across processes are rebuilt from their location.
+        return (ParseError, (self.msg, _ErrorLocation(self.line,
+                                                      self.filename)))
+
+
+class _ErrorLocation:
+    """
+    Stands for the context of a ParseError being unpickled.
+    """
+    def __init__(self, line, filename):
+        self._line = line
+        self._filename = filename
+
+    def line(self):
+        return self._line
+
+    def filename(self):
+        return self._filename
+
+
+def parse_file(filepath, recover=False):
+    """
+    Convenience function taking a file path instead of a file descriptor.
+    """
+    with open(filepath) as fd:
+        return parse(fd, recover)
+
+
+def parse(fd, recover=False):
+    """
+    Parse an already opened massif output file.
+
+    If recover is true, errors in the snapshots don't abort the parsing. The
+    incomplete snapshot is dropped, an error diagnostic is appended to the
+    mdata["diagnostics"] list and parsing resumes at the next snapshot. This is
+    mostly useful for files truncated by a killed process, whose last line,
+    lacking a newline, is always considered an error. The header must be
+    well formed in any case.
+    """
+    mdata = {}
+    ctx = ParseContext(fd)
+    _parse_header(ctx, mdata)
+    if recover:
+        diagnostics = []
+        _add_snapshots(mdata, _recover_snapshots(_RecoveryContext(ctx),
+                                                 diagnostics))
+        mdata["diagnostics"] = diagnostics
+    else:
+        _parse_snapshots(ctx, mdata)
+    return Profile(mdata)
+
+
+def merge(files, workers=1, average=False, recover=False):
+    """
+    Merge the massif.out files at the given paths into a single profile. The
+    files are parsed by a pool of worker processes and folded into the merged
+    profile one at a time, so that only the merged data is kept in memory.
+
+    The memory usage of the runs is combined onto the union of their snapshot
+    times, each run contributing the values of its latest snapshot at any
+    given time. The heap trees of the largest detailed snapshot of each run
+    are merged by call stack, identifying the frames by function, file and
+    line. Values are summed, or averaged over the runs if average is true.
+
+    The result has the keys of the one of parse, plus the number of runs and
+    the merged heap tree in merged_peak_heap_tree, or None. The runs peak at
+    different times, so the merged tree doesn't describe any merged snapshot
+    and its total generally differs from all of them. The merged snapshots
+    thus have no heap tree and there is no peak snapshot.
+
+    If recover is true, the files are parsed in recovery mode and the
+    diagnostics of all the files are gathered in mdata["diagnostics"], each
+    also holding the path of its file.
+    """
+    files = list(files)
+    merged = _MergedProfile()
+
+    if workers > 1 and len(files) > 1:
+        import functools
+        import multiprocessing
+        summarize = functools.partial(_summarize_file, recover=recover)
+        pool = multiprocessing.Pool(min(workers, len(files)))
+        try:
+            for summary in pool.imap(summarize, files):
+                merged.add(summary)
+        finally:
+            pool.terminate()
+    else:
+        for path in files:
+            merged.add(_summarize_file(path, recover))
+
+    return merged.result(average)
+
+
+def _summarize_file(path, recover=False):
+    """
+    Parse a file and only keep what merge needs, i.e. the header, the memory
+    usage over time, the heap tree of the largest detailed snapshot and the
+    diagnostics, if any.
+    """
+    mdata = parse_file(path, recover)
+    snapshots = mdata["snapshots"]
+
+    series = []
+    for snapshot in snapshots:
+        series.append((snapshot["time"], snapshot["mem_heap"],
+                       snapshot["mem_heap_extra"], snapshot["mem_stack"]))
+
+    peak_heap_tree = None
+    peak_heap = None
+    for index in mdata["detailed_snapshot_indices"]:
+        snapshot = snapshots[index]
+        heap = snapshot["mem_heap"] + snapshot["mem_heap_extra"]
+        if peak_heap is None or heap > peak_heap:
+            peak_heap = heap
+            peak_heap_tree = snapshot["heap_tree"]
+
+    summary = {
+        "desc": mdata["desc"],
+        "cmd": mdata["cmd"],
+        "time_unit": mdata["time_unit"],
+        "series": series,
+        "peak_heap_tree": peak_heap_tree
+    }
+    if recover:
+        summary["diagnostics"] = [dict(diagnostic, path=path) for diagnostic
+                                  in mdata["diagnostics"]]
+    return summary
+
+
+class _MergedProfile:
+    """
+    Accumulator folding the summaries returned by _summarize_file. The time
+    series are kept as the sum of the changes of each run at each time, the
+    heap trees as nodes whose children are keyed by frame.
+    """
+    def __init__(self):
+        self._header = None
+        self._runs = 0
+        self._deltas = {}
+        self._tree = None
+        self._diagnostics = None
+
+    def add(self, summary):
+        if self._header is None:
+            self._header = summary
+        elif summary["time_unit"] != self._header["time_unit"]:
+            raise ValueError("can't merge files with different time units")
+        self._runs += 1
+
+        if "diagnostics" in summary:
+            if self._diagnostics is None:
+                self._diagnostics = []
+            self._diagnostics.extend(summary["diagnostics"])
+
+        previous = (0, 0, 0)
+        for (time, heap, extra, stack) in summary["series"]:
+            delta = self._deltas.setdefault(time, [0, 0, 0])
+            delta[0] += heap - previous[0]
+            delta[1] += extra - previous[1]
+            delta[2] += stack - previous[2]
+            previous = (heap, extra, stack)
+
+        if summary["peak_heap_tree"] is not None:
+            if self._tree is None:
+                self._tree = _new_merged_node(None)
+            _merge_heap_tree(self._tree, summary["peak_heap_tree"])
+
+    def result(self, average):
+        header = self._header or {"desc": None, "cmd": None,
+                                  "time_unit": None}
+        divisor = 1
+        if average and self._runs > 0:
+            divisor = self._runs
+
+        snapshots = []
+        values = [0, 0, 0]
+        for time in sorted(self._deltas):
+            delta = self._deltas[time]
+            for i in range(3):
+                values[i] += delta[i]
+            snapshots.append({
+                "id": len(snapshots),
+                "time": time,
+                "mem_heap": _divide(values[0], divisor),
+                "mem_heap_extra": _divide(values[1], divisor),
+                "mem_stack": _divide(values[2], divisor),
+                "heap_tree": None
+            })
+
+        merged_peak_heap_tree = None
+        if self._tree is not None:
+            merged_peak_heap_tree = _finish_merged_node(self._tree, divisor)
+
+        mdata = {
+            "desc": header["desc"],
+            "cmd": header["cmd"],
+            "time_unit": header["time_unit"],
+            "runs": self._runs,
+            "merged_peak_heap_tree": merged_peak_heap_tree
+        }
+        if self._diagnostics is not None:
+            mdata["diagnostics"] = self._diagnostics
+        _add_snapshots(mdata, [{
+            "data": snapshot,
+            "is_detailed": False,
+            "is_peak": False
+        } for snapshot in snapshots])
+        return Profile(mdata)
+
+
+def _divide(value, divisor):
+    if divisor == 1:
+        return value
+    return float(value) / divisor
+
+
+def _new_merged_node(details):
+    return {"nbytes": 0, "children": {}, "details": details}
+
+
+def _merge_heap_tree(merged, heap_tree):
+    """
+    Add the bytes of heap_tree to the merged node, recursively matching the
+    children by frame. Entries below massif's threshold are merged together.
+    """
+    merged["nbytes"] += heap_tree["nbytes"]
+    for child in heap_tree["children"]:
+        details = child["details"]
+        key = None
+        if details is not None:
+            key = (details["function"], details["file"], details["line"])
+        merged_child = merged["children"].get(key)
+        if merged_child is None:
+            if details is not None:
+                # Addresses are specific to a run, don't pretend otherwise.
+                details = dict(details)
+                details["address"] = None
+            merged_child = _new_merged_node(details)
+            merged["children"][key] = merged_child
+        _merge_heap_tree(merged_child, child)
+
+
+def _finish_merged_node(merged, divisor):
+    """
+    Turn a merged node back into a regular heap tree node, children being
+    sorted by decreasing size like massif does.
+    """
+    children = [_finish_merged_node(child, divisor)
+                for child in merged["children"].values()]
+    children.sort(key=lambda child: -child["nbytes"])
+    return {
+        "nbytes": _divide(merged["nbytes"], divisor),
+        "children": children,
+        "details": merged["details"]
+    }
+
+
+def leak_suspects(mdata):
+    """
+    Look for call sites whose memory grows steadily over the detailed
+    snapshots of mdata. A call site is a node of the heap trees, identified
+    by its call stack. A linear trend of its bytes against time is fitted,
+    counting zero bytes in the snapshots where the site doesn't appear.
+
+    Only the sites which never shrink and whose trend is growing are kept,
+    ranked by decreasing slope. On ties, which happen when a caller's growth
+    comes from a single callee, the more specific call stack comes first.
+    Each suspect is a dictionary holding the details of the site, the path of
+    details from the allocation function down to the site, the slope in bytes
+    per time unit, the r_squared of the fit and the first and last nbytes of
+    the site. The cost is linear in the number of heap tree nodes.
+    """
+    snapshots = mdata["snapshots"]
+    num_points = len(mdata["detailed_snapshot_indices"])
+    sum_t = 0
+    sum_tt = 0
+    sites = {}
+
+    for (position, index) in enumerate(mdata["detailed_snapshot_indices"]):
+        time = snapshots[index]["time"]
+        sum_t += time
+        sum_tt += time * time
+
+        stack = [(child, None) for child in
+                 snapshots[index]["heap_tree"]["children"]]
+        while stack:
+            (node, parent) = stack.pop()
+            details = node["details"]
+            if details is None:
+                continue
+            key = (parent, details["address"], details["function"],
+                   details["file"], details["line"])
+            site = sites.get(key)
+            if site is None:
+                site = _SiteTrend(parent, details)
+                sites[key] = site
+            site.add(position, time, node["nbytes"])
+            for child in node["children"]:
+                stack.append((child, site))
+
+    time_variance = num_points * sum_tt - sum_t * sum_t
+    if time_variance == 0:
+        return []
+
+    suspects = []
+    for site in sites.values():
+        if site.shrinks(num_points):
+            continue
+        covariance = num_points * site.sum_tb - sum_t * site.sum_b
+        if covariance <= 0:
+            continue
+        bytes_variance = num_points * site.sum_bb - site.sum_b * site.sum_b
+        suspects.append({
+            "details": site.details,
+            "path": site.path(),
+            "slope": float(covariance) / time_variance,
+            "r_squared": (float(covariance) * covariance /
+                          (float(time_variance) * bytes_variance)),
+            "first_nbytes": site.first_nbytes,
+            "last_nbytes": site.last_nbytes
+        })
+
+    suspects.sort(key=lambda suspect: (-suspect["slope"],
+                                       -len(suspect["path"])))
+    return suspects
+
+
+class _SiteTrend:
+    """
+    Regression accumulators of a call site. Only the sums involving its bytes
+    are kept here, the sums over time being shared by every site.
+    """
+    def __init__(self, parent, details):
+        self.parent = parent
+        self.details = details
+        self.sum_b = 0
+        self.sum_tb = 0
+        self.sum_bb = 0
+        self.first_nbytes = None
+        self.last_nbytes = None
+        self.last_position = None
+        self.shrunk = False
+
+    def add(self, position, time, nbytes):
+        if self.last_position is None:
+            self.first_nbytes = nbytes
+        elif nbytes < self.last_nbytes:
+            self.shrunk = True
+        elif self.last_position != position - 1 and self.last_nbytes > 0:
+            # The site went missing in between, i.e. down to zero bytes.
+            self.shrunk = True
+
+        self.sum_b += nbytes
+        self.sum_tb += time * nbytes
+        self.sum_bb += nbytes * nbytes
+        self.last_nbytes = nbytes
+        self.last_position = position
+
+    def shrinks(self, num_points):
+        if self.shrunk:
+            return True
+        return self.last_position != num_points - 1 and self.last_nbytes > 0
+
+    def path(self):
+        path = []
+        site = self
+        while site is not None:
+            path.append(site.details)
+            site = site.parent
+        path.reverse()
+        return path
+
+
+def _match_unconditional(ctx, regex, string):
+    """
+    Unconditionaly match a regular expression against a string, i.e. if there
+    is no match we raise a ParseError.
+    """
+    match = regex.match(string)
+    if match is None:
+        raise ParseError("".join(["can't match '", string, "' against '",
+                         regex.pattern, "'"]), ctx)
+    return match
+
+
+def _get_next_line(ctx, may_reach_eof=False):
+    """
+    Read another line from ctx. If may_reach_eof is False, reaching EOF will
+    be considered as an error.
+    """
+    line = ctx.readline()  # Returns an empty string on EOF.
+
+    if len(line) == 0:
+        if may_reach_eof is False:
+            raise ParseError("unexpected EOF", ctx)
+        else:
+            return None
+    else:
+        return line.strip("\n")
+
+
+def _get_next_field(ctx, field_regex, may_reach_eof=False):
+    """
+    Read the next data field. The field_regex arg is a regular expression that
+    will be used to match the field. Data will be extracted from the match
+    object by calling m.group('data'). If may_reach_eof is False, reaching EOF
+    will be considered as an error.
+    """
+    line = _get_next_line(ctx, may_reach_eof)
+    while line is not None:
+        if _COMMENT_RE.match(line):
+            line = _get_next_line(ctx, may_reach_eof)
+        else:
+            match = _match_unconditional(ctx, field_regex, line)
+            return match.group("data")
+
+    return None
+
+
+def _parse_header(ctx, mdata):
+    mdata["desc"] = _get_next_field(ctx, _FIELD_DESC_RE)
+    mdata["cmd"] = _get_next_field(ctx, _FIELD_CMD_RE)
+    mdata["time_unit"] = _get_next_field(ctx, _FIELD_TIME_UNIT_RE)
+
+
+def _parse_snapshots(ctx, mdata):
+    _add_snapshots(mdata, _iter_snapshots(ctx))
+
+
+def _iter_snapshots(ctx):
+    """
+    Yield the snapshots returned by _parse_snapshot until EOF.
+    """
+    snapshot = _parse_snapshot(ctx)
+    while snapshot is not None:
+        yield snapshot
+        snapshot = _parse_snapshot(ctx)
+
+
+def _recover_snapshots(ctx, diagnostics):
+    """
+    Like _iter_snapshots, but on errors the incomplete snapshot is dropped,
+    a diagnostic is appended to the diagnostics list and parsing resumes at the
+    next snapshot line.
+    """
+    snapshot_id = None
+    while True:
+        try:
+            if snapshot_id is None:
+                snapshot = _parse_snapshot(ctx)
+            else:
+                snapshot = _parse_snapshot_fields(ctx, snapshot_id)
+        except ParseError:
+            err = sys.exc_info()[1]
+            diagnostics.append({"line": err.line, "message": err.msg})
+            snapshot_id = _find_next_snapshot(ctx)
+            if snapshot_id is None:
+                return
+            continue
+
+        if snapshot is None:
+            return
+        snapshot_id = None
+        yield snapshot
+
+
+def _find_next_snapshot(ctx):
+    """
+    Skip lines until the next snapshot line, starting with the line which
+    caused the error. Returns the id of the snapshot, or None on EOF.
+    """
+    line = ctx.last_line
+    # A line without newline is a truncated last line, skip it too.
+    while line.endswith("\n"):
+        match = _FIELD_SNAPSHOT_RE.match(line.strip("\n"))
+        if match is not None:
+            return int(match.group("data"))
+        try:
+            line = ctx.readline()
+        except ParseError:
+            return None
+    return None
+
+
+def _add_snapshots(mdata, snapshots):
+    """
+    Store the snapshots returned by _parse_snapshot in mdata, keeping track of
+    the detailed and peak snapshots and computing the summary statistics as
+    they go.
+    """
+    mdata["snapshots"] = []
+    mdata["detailed_snapshot_indices"] = []
+    stats = _SnapshotStats()
+
+    for snapshot in snapshots:
+        index = len(mdata["snapshots"])
+        if snapshot["is_detailed"]:
+            mdata["detailed_snapshot_indices"].append(index)
+        if snapshot["is_peak"]:
+            mdata["peak_snapshot_index"] = index
+        mdata["snapshots"].append(snapshot["data"])
+        stats.add(snapshot["data"])
+
+    mdata["stats"] = stats.result()
+
+
+class _SnapshotStats:
+    """
+    Summary statistics accumulated one snapshot at a time. The heap usage is
+    mem_heap + mem_heap_extra and the total memory usage also includes
+    mem_stack. Unlike massif's peak marker, the peaks are exact and consider
+    every snapshot, detailed or not.
+    """
+    PERCENTILES = [50, 90, 95, 99]
+
+    def __init__(self):
+        self._index = 0
+        self._peak_heap = None
+        self._peak_heap_index = None
+        self._peak_total = None
+        self._peak_total_index = None
+        self._totals = []
+        self._growth_rates = []
+        self._previous = None
+
+    def add(self, snapshot):
+        heap = snapshot["mem_heap"] + snapshot["mem_heap_extra"]
+        total = heap + snapshot["mem_stack"]
+
+        if self._peak_heap is None or heap > self._peak_heap:
+            self._peak_heap = heap
+            self._peak_heap_index = self._index
+        if self._peak_total is None or total > self._peak_total:
+            self._peak_total = total
+            self._peak_total_index = self._index
+
+        # The growth rate of the total memory usage since the previous
+        # snapshot, in bytes per time unit. Snapshots can share the same time,
+        # in which case there is no rate.
+        growth_rate = None
+        if self._previous is not None:
+            (previous_time, previous_total) = self._previous
+            if snapshot["time"] != previous_time:
+                growth_rate = (float(total - previous_total) /
+                               (snapshot["time"] - previous_time))
+
+        self._growth_rates.append(growth_rate)
+        self._totals.append(total)
+        self._previous = (snapshot["time"], total)
+        self._index += 1
+
+    def result(self):
+        # Nearest-rank percentiles of the total memory usage.
+        percentiles = {}
+        totals = sorted(self._totals)
+        for percentile in self.PERCENTILES:
+            value = None
+            if totals:
+                rank = max(1, (percentile * len(totals) + 99) // 100)
+                value = totals[rank - 1]
+            percentiles["p" + str(percentile)] = value
+
+        return {
+            "peak_heap_index": self._peak_heap_index,
+            "peak_heap": self._peak_heap,
+            "peak_total_index": self._peak_total_index,
+            "peak_total": self._peak_total,
+            "total_percentiles": percentiles,
+            "growth_rates": self._growth_rates
+        }
+
+
+def _parse_snapshot(ctx):
+    """
+    Parse another snapshot, appending it to the mdata["snapshots"] list. On
+    EOF, False will be returned.
+    """
+    snapshot_id = _get_next_field(ctx, _FIELD_SNAPSHOT_RE, may_reach_eof=True)
+
+    if snapshot_id is None:
+        return None
+
+    return _parse_snapshot_fields(ctx, int(snapshot_id))
+
+
+def _parse_snapshot_fields(ctx, snapshot_id):
+    """
+    Parse the rest of a snapshot, after its snapshot line.
+    """
+    time = int(_get_next_field(ctx, _FIELD_TIME_RE))
+    mem_heap = int(_get_next_field(ctx, _FIELD_MEM_HEAP_RE))
+    mem_heap_extra = int(_get_next_field(ctx, _FIELD_MEM_EXTRA_RE))
+    mem_stacks = int(_get_next_field(ctx, _FIELD_MEM_STACK_RE))
+    heap_tree_field = _get_next_field(ctx, _FIELD_HEAP_TREE_RE)
+
+    heap_tree = None
+    is_detailed = False
+    is_peak = False
+
+    if heap_tree_field != "empty":
+        is_detailed = True
+        if heap_tree_field == "peak":
+            is_peak = True
+        heap_tree = _parse_heap_tree(ctx)
+
+    return {
+        "is_detailed": is_detailed,
+        "is_peak": is_peak,
+        "data": {
+            "id": snapshot_id,
+            "time": time,
+            "mem_heap": mem_heap,
+            "mem_heap_extra": mem_heap_extra,
+            "mem_stack": mem_stacks,
+            "heap_tree": heap_tree
+        }
+    }
+
+
+def _parse_heap_tree(ctx):
+    """
+    Parse a heap tree, using the native scanner when it is available.
+    """
+    if _speedups is not None:
+        return _speedups.parse_heap_tree(ctx, _parse_heap_entry)
+    return _py_parse_heap_tree(ctx)
+
+
+def _py_parse_heap_tree(ctx):
+    """
+    Parse a heap tree. Pure Python implementation.
+    """
+    line = _get_next_line(ctx)
+    (num_children, nbytes, details) = _parse_heap_entry(ctx, line)
+
+    children = []
+    for i in range(0, num_children):
+        children.append(_py_parse_heap_tree(ctx))
+
+    heap_node = {}
+    heap_node["nbytes"] = nbytes
+    heap_node["children"] = children
+    heap_node["details"] = details
+
+    return heap_node
+
+
+def _parse_heap_entry(ctx, line):
+    """
+    Parse a single heap tree entry, returning a (num_children, nbytes, details)
+    tuple. A line of None stands for EOF, which is always an error here. The
+    native scanner also calls this function for the lines it can't handle.
+    """
+    if line is None:
+        raise ParseError("unexpected EOF", ctx)
+
+    entry_match = _match_unconditional(ctx, _HEAP_ENTRY_RE, line)
+    details_group = entry_match.group("details")
+
+    details = None
+    details_match = _HEAP_DETAILS_RE.match(details_group)
+
+    if details_match:
+        # The 'line' field could be None if the binary/library wasn't compiled
+        # with debug info. To avoid errors on this condition, we need to make
+        # sure that the 'line' field is not None before trying to convert it to
+        # an integer.
+        linum = details_match.group(4)
+        if linum is not None:
+            linum = int(linum)
+
+        details = {
+            "address": details_match.group("address"),
+            "function": details_match.group("function"),
+            "file": details_match.group("fname"),
+            "line": linum
+        }
+
+    return (int(entry_match.group("num_children")),
+            int(entry_match.group("num_bytes")),
+            details)
@@ -0,0 +1,441 @@
+/*
+ * Copyright (c) 2011 Mathieu Turcotte
+ * Licensed under the MIT license.
+ *
+ * Native heap tree scanner for the msparser module. It implements the same
+ * grammar as the _HEAP_ENTRY_RE and _HEAP_DETAILS_RE regexes of
+ * msparser/__init__.py, but only for plain ASCII lines. Any line which
+ * doesn't match, or which contains something the fast path isn't sure about,
+ * is handed back to the pure Python msparser._parse_heap_entry function so
+ * that both backends produce exactly the same results and the same errors.
+ */
+
+#define PY_SSIZE_T_CLEAN
+#include <Python.h>
+
+/* Numbers with more digits than this are left to the Python fallback. */
+#define MAX_FAST_DIGITS 18
+
+static PyObject *str_readline;
+static PyObject *str_nbytes;
+static PyObject *str_children;
+static PyObject *str_details;
+static PyObject *str_address;
+static PyObject *str_function;
+static PyObject *str_file;
+static PyObject *str_line;
+
+/* Same set of characters as \s for str patterns of the re module. */
+static int
+is_space(char c)
+{
+    return c == ' ' || c == '\t' || c == '\n' || c == '\r' || c == '\f' ||
+           c == '\v' || (c >= '\x1c' && c <= '\x1f');
+}
+
+static int
+is_digit(char c)
+{
+    return c >= '0' && c <= '9';
+}
+
+/* Matches [a-fA-F0-9x]. */
+static int
+is_address(char c)
+{
+    return is_digit(c) || (c >= 'a' && c <= 'f') || (c >= 'A' && c <= 'F') ||
+           c == 'x';
+}
+
+/*
+ * Scan one or more digits starting at *pos. On success, *pos is moved past
+ * the digits and the value is stored in *value. Returns 0 if there is no
+ * digit or if there are too many of them.
+ */
+static int
+scan_number(const char *s, Py_ssize_t end, Py_ssize_t *pos, long long *value)
+{
+    Py_ssize_t i = *pos;
+    long long v = 0;
+
+    while (i < end && is_digit(s[i])) {
+        if (i - *pos >= MAX_FAST_DIGITS)
+            return 0;
+        v = v * 10 + (s[i] - '0');
+        i++;
+    }
+
+    if (i == *pos)
+        return 0;
+
+    *pos = i;
+    *value = v;
+    return 1;
+}
+
+/*
+ * Match the content of the parentheses following the function name, i.e.
+ * (?:in\s)?(?P<fname>[^:]+):?(?P<line>\d+)? over [start, end). On success,
+ * the file name bounds are stored in fname and the line number bounds in
+ * linum, an empty line number range meaning that there is none.
+ */
+static int
+scan_location(const char *s, Py_ssize_t start, Py_ssize_t end,
+              Py_ssize_t fname[2], Py_ssize_t linum[2])
+{
+    Py_ssize_t colon = -1;
+    Py_ssize_t i;
+
+    for (i = start; i < end; i++) {
+        if (s[i] == ':') {
+            if (colon != -1)
+                return 0;
+            colon = i;
+        }
+    }
+
+    if (colon == -1) {
+        fname[1] = end;
+        linum[0] = linum[1] = end;
+    } else {
+        for (i = colon + 1; i < end; i++) {
+            if (!is_digit(s[i]))
+                return 0;
+        }
+        fname[1] = colon;
+        linum[0] = colon + 1;
+        linum[1] = end;
+    }
+
+    /* Skip 'in ' if present, unless it leaves an empty file name. */
+    if (fname[1] - start > 3 && s[start] == 'i' && s[start + 1] == 'n' &&
+            is_space(s[start + 2]))
+        fname[0] = start + 3;
+    else
+        fname[0] = start;
+
+    return fname[1] > fname[0];
+}
+
+/*
+ * Match the details section over [start, end) and return the corresponding
+ * details dictionary, None if the section doesn't match or NULL on error.
+ */
+static PyObject *
+scan_details(PyObject *line, const char *s, Py_ssize_t start, Py_ssize_t end)
+{
+    Py_ssize_t i = start;
+    Py_ssize_t func_start, func_end;
+    Py_ssize_t fname[2] = {0, 0};
+    Py_ssize_t linum[2] = {0, 0};
+    int has_location = 0;
+    PyObject *details, *value;
+
+    while (i < end && is_address(s[i]))
+        i++;
+    if (i == start || i + 1 >= end || s[i] != ':' || !is_space(s[i + 1]))
+        Py_RETURN_NONE;
+
+    func_start = i + 2;
+    if (func_start >= end)
+        Py_RETURN_NONE;
+
+    /* The function name is non-greedy: stop at the first ' (...)' suffix. */
+    func_end = end;
+    if (s[end - 1] == ')') {
+        for (i = func_start + 1; i + 2 < end; i++) {
+            if (is_space(s[i]) && s[i + 1] == '(' &&
+                    scan_location(s, i + 2, end - 1, fname, linum)) {
+                func_end = i;
+                has_location = 1;
+                break;
+            }
+        }
+    }
+
+    details = PyDict_New();
+    if (details == NULL)
+        return NULL;
+
+    value = PyUnicode_Substring(line, start, func_start - 2);
+    if (value == NULL || PyDict_SetItem(details, str_address, value) < 0)
+        goto error;
+    Py_DECREF(value);
+
+    value = PyUnicode_Substring(line, func_start, func_end);
+    if (value == NULL || PyDict_SetItem(details, str_function, value) < 0)
+        goto error;
+    Py_DECREF(value);
+
+    if (has_location) {
+        value = PyUnicode_Substring(line, fname[0], fname[1]);
+        if (value == NULL)
+            goto error;
+    } else {
+        value = Py_None;
+        Py_INCREF(value);
+    }
+    if (PyDict_SetItem(details, str_file, value) < 0)
+        goto error;
+    Py_DECREF(value);
+
+    if (has_location && linum[1] > linum[0]) {
+        long long number;
+        i = linum[0];
+        if (!scan_number(s, linum[1], &i, &number)) {
+            /* Too many digits, let the Python implementation handle it. */
+            Py_DECREF(details);
+            return NULL;
+        }
+        value = PyLong_FromLongLong(number);
+        if (value == NULL)
+            goto error;
+    } else {
+        value = Py_None;
+        Py_INCREF(value);
+    }
+    if (PyDict_SetItem(details, str_line, value) < 0)
+        goto error;
+    Py_DECREF(value);
+
+    return details;
+
+error:
+    Py_XDECREF(value);
+    Py_DECREF(details);
+    return NULL;
+}
+
+/*
+ * Scan a heap entry line, i.e. \s*n(\d+):\s(\d+)\s(.*). Returns 1 on success,
+ * storing the details dictionary (or None) in *details, 0 if the line should
+ * be handed to the Python fallback and -1 on error.
+ */
+static int
+scan_entry(PyObject *line, long long *num_children, long long *nbytes,
+           PyObject **details)
+{
+    const char *s;
+    Py_ssize_t i = 0;
+    Py_ssize_t end;
+
+    if (!PyUnicode_IS_ASCII(line))
+        return 0;
+
+    s = (const char *) PyUnicode_DATA(line);
+    end = PyUnicode_GET_LENGTH(line);
+
+    while (i < end && is_space(s[i]))
+        i++;
+    if (i >= end || s[i++] != 'n')
+        return 0;
+    if (!scan_number(s, end, &i, num_children))
+        return 0;
+    if (i + 1 >= end || s[i] != ':' || !is_space(s[i + 1]))
+        return 0;
+    i += 2;
+    if (!scan_number(s, end, &i, nbytes))
+        return 0;
+    if (i >= end || !is_space(s[i]))
+        return 0;
+    i++;
+
+    *details = scan_details(line, s, i, end);
+    if (*details == NULL) {
+        if (PyErr_Occurred())
+            return -1;
+        return 0;
+    }
+
+    return 1;
+}
+
+/*
+ * Read the next line from the context, stripping the newlines like the
+ * _get_next_line function does. Returns Py_None on EOF.
+ */
+static PyObject *
+read_line(PyObject *ctx)
+{
+    PyObject *raw, *line;
+    Py_ssize_t start = 0, end;
+
+    raw = PyObject_CallMethodObjArgs(ctx, str_readline, NULL);
+    if (raw == NULL)
+        return NULL;
+
+    if (!PyUnicode_Check(raw)) {
+        PyErr_Format(PyExc_TypeError, "readline() returned %.200s, not str",
+                     Py_TYPE(raw)->tp_name);
+        Py_DECREF(raw);
+        return NULL;
+    }
+
+    end = PyUnicode_GET_LENGTH(raw);
+    if (end == 0) {
+        Py_DECREF(raw);
+        Py_RETURN_NONE;
+    }
+
+    while (start < end && PyUnicode_READ_CHAR(raw, start) == '\n')
+        start++;
+    while (end > start && PyUnicode_READ_CHAR(raw, end - 1) == '\n')
+        end--;
+
+    line = PyUnicode_Substring(raw, start, end);
+    Py_DECREF(raw);
+    return line;
+}
+
+/*
+ * Use the Python fallback to parse a line, which returns a
+ * (num_children, nbytes, details) tuple or raises a ParseError.
+ */
+static int
+fallback_entry(PyObject *ctx, PyObject *line, PyObject *parse_entry,
+               long long *num_children, PyObject **nbytes, PyObject **details)
+{
+    PyObject *entry;
+
+    entry = PyObject_CallFunctionObjArgs(parse_entry, ctx, line, NULL);
+    if (entry == NULL)
+        return -1;
+
+    if (!PyTuple_Check(entry) || PyTuple_GET_SIZE(entry) != 3) {
+        PyErr_SetString(PyExc_TypeError,
+                        "heap entry parser must return a 3-tuple");
+        Py_DECREF(entry);
+        return -1;
+    }
+
+    *num_children = PyLong_AsLongLong(PyTuple_GET_ITEM(entry, 0));
+    if (*num_children == -1 && PyErr_Occurred()) {
+        Py_DECREF(entry);
+        return -1;
+    }
+
+    *nbytes = PyTuple_GET_ITEM(entry, 1);
+    *details = PyTuple_GET_ITEM(entry, 2);
+    Py_INCREF(*nbytes);
+    Py_INCREF(*details);
+    Py_DECREF(entry);
+    return 0;
+}
+
+static PyObject *
+parse_heap_tree_impl(PyObject *ctx, PyObject *parse_entry)
+{
+    PyObject *line;
+    PyObject *nbytes = NULL, *details = NULL, *children = NULL;
+    PyObject *node = NULL;
+    long long num_children, fast_nbytes, i;
+    int status;
+
+    line = read_line(ctx);
+    if (line == NULL)
+        return NULL;
+
+    status = line == Py_None ? 0 : scan_entry(line, &num_children,
+                                              &fast_nbytes, &details);
+    if (status < 0) {
+        Py_DECREF(line);
+        return NULL;
+    } else if (status == 0) {
+        status = fallback_entry(ctx, line, parse_entry, &num_children,
+                                &nbytes, &details);
+        Py_DECREF(line);
+        if (status < 0)
+            return NULL;
+    } else {
+        Py_DECREF(line);
+        nbytes = PyLong_FromLongLong(fast_nbytes);
+        if (nbytes == NULL)
+            goto done;
+    }
+
+    children = PyList_New(0);
+    if (children == NULL)
+        goto done;
+
+    if (Py_EnterRecursiveCall(" while parsing a heap tree"))
+        goto done;
+    for (i = 0; i < num_children; i++) {
+        PyObject *child = parse_heap_tree_impl(ctx, parse_entry);
+        if (child == NULL || PyList_Append(children, child) < 0) {
+            Py_XDECREF(child);
+            Py_LeaveRecursiveCall();
+            goto done;
+        }
+        Py_DECREF(child);
+    }
+    Py_LeaveRecursiveCall();
+
+    node = PyDict_New();
+    if (node == NULL)
+        goto done;
+    if (PyDict_SetItem(node, str_nbytes, nbytes) < 0 ||
+            PyDict_SetItem(node, str_children, children) < 0 ||
+            PyDict_SetItem(node, str_details, details) < 0) {
+        Py_CLEAR(node);
+    }
+
+done:
+    Py_XDECREF(nbytes);
+    Py_XDECREF(details);
+    Py_XDECREF(children);
+    return node;
+}
+
+PyDoc_STRVAR(parse_heap_tree_doc,
+"parse_heap_tree(ctx, parse_entry) -> dict\n\
+\n\
+Parse a heap tree from ctx. The parse_entry function is called with the\n\
+context and the stripped line, or None on EOF, for every entry the native\n\
+scanner can't handle and must return a (num_children, nbytes, details)\n\
+tuple.");
+
+static PyObject *
+parse_heap_tree(PyObject *self, PyObject *args)
+{
+    PyObject *ctx, *parse_entry;
+
+    if (!PyArg_ParseTuple(args, "OO:parse_heap_tree", &ctx, &parse_entry))
+        return NULL;
+
+    return parse_heap_tree_impl(ctx, parse_entry);
+}
+
+static PyMethodDef speedups_methods[] = {
+    {"parse_heap_tree", parse_heap_tree, METH_VARARGS, parse_heap_tree_doc},
+    {NULL, NULL, 0, NULL}
+};
+
+static struct PyModuleDef speedups_module = {
+    PyModuleDef_HEAD_INIT,
+    "msparser._speedups",
+    "Native heap tree scanner for the msparser module.",
+    -1,
+    speedups_methods
+};
+
+#define INTERN(var, value)                          \
+    do {                                            \
+        var = PyUnicode_InternFromString(value);    \
+        if (var == NULL)                            \
+            return NULL;                            \
+    } while (0)
+
+PyMODINIT_FUNC
+PyInit__speedups(void)
+{
+    INTERN(str_readline, "readline");
+    INTERN(str_nbytes, "nbytes");
+    INTERN(str_children, "children");
+    INTERN(str_details, "details");
+    INTERN(str_address, "address");
+    INTERN(str_function, "function");
+    INTERN(str_file, "file");
+    INTERN(str_line, "line");
+
+    return PyModule_Create(&speedups_module);
+}
@@ -0,0 +1,184 @@
+# Copyright (c) 2011 Mathieu Turcotte
+# Licensed under the MIT license.
+
+"""
+The msparser.aio module offers an asyncio interface to the massif.out parser,
+for applications which can't afford to block their event loop while parsing
+large files. It requires Python 3.6 or newer.
+
+The file is read in large chunks and cut on snapshot boundaries. The reads
+are done in a bounded thread pool and the complete snapshots are parsed in
+the same pool, or in the executor given by the caller, which may be a process
+pool. Control is given back to the event loop between snapshots. Each block
+is parsed with its own context, so concurrent parses share no state.
+"""
+
+import asyncio
+import concurrent.futures
+import io
+import os.path
+import threading
+
+import msparser
+
+__all__ = ["parse_file", "iter_snapshots", "CHUNK_SIZE", "MAX_WORKERS"]
+
+# Number of characters read from the file at once.
+CHUNK_SIZE = 1 << 20
+
+# Number of threads of the default executor, which also does all the reads.
+MAX_WORKERS = 4
+
+# Every snapshot starts with such a line, which is used to cut the file into
+# blocks of complete snapshots.
+_SNAPSHOT_MARKER = "\nsnapshot="
+
+_default_executor = None
+_default_executor_lock = threading.Lock()
+
+
+class _BlockContext(msparser.ParseContext):
+    """
+    A parsing context over a block of text starting at a given line of a file.
+    """
+    def __init__(self, block, filename, first_line):
+        msparser.ParseContext.__init__(self, io.StringIO(block))
+        self._line = first_line
+        self._filename = filename
+
+    def filename(self):
+        return self._filename
+
+
+def _get_default_executor():
+    global _default_executor
+    with _default_executor_lock:
+        if _default_executor is None:
+            _default_executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=MAX_WORKERS)
+        return _default_executor
+
+
+async def parse_file(path, executor=None, chunk_size=CHUNK_SIZE):
+    """
+    Asynchronous version of msparser.parse_file. The returned data is exactly
+    the same. The snapshots are parsed in the given concurrent.futures
+    executor, if any, while the file is always read in the module's thread
+    pool.
+    """
+    mdata = {}
+    snapshots = []
+    async for snapshot in _iter_parsed(path, mdata, executor, chunk_size):
+        snapshots.append(snapshot)
+
+    msparser._add_snapshots(mdata, snapshots)
+    return msparser.Profile(mdata)
+
+
+async def iter_snapshots(path, executor=None, chunk_size=CHUNK_SIZE):
+    """
+    Asynchronously iterate over the snapshots of a massif.out file. Each
+    snapshot is yielded as soon as it has been parsed, in the same format as
+    the elements of the snapshots list returned by msparser.parse. The
+    executor is used as for parse_file.
+    """
+    parsed = _iter_parsed(path, {}, executor, chunk_size)
+    try:
+        async for snapshot in parsed:
+            yield snapshot["data"]
+    finally:
+        # Closing this generator doesn't close the inner one, which holds the
+        # file open.
+        await parsed.aclose()
+
+
+async def _iter_parsed(path, mdata, executor, chunk_size):
+    """
+    Yield the snapshots returned by msparser._parse_snapshot, storing the
+    header fields in mdata.
+    """
+    # The file can't leave this process, so it is only handled by threads.
+    reader = _get_default_executor()
+    if executor is None:
+        executor = reader
+
+    filename = os.path.abspath(path)
+    opening = reader.submit(open, path)
+    try:
+        fd = await asyncio.wrap_future(opening)
+    except asyncio.CancelledError:
+        opening.add_done_callback(_close_opened)
+        raise
+
+    pending = None
+
+    try:
+        parts = []
+        line = 0
+        eof = False
+
+        while not eof:
+            pending = reader.submit(fd.read, chunk_size)
+            chunk = await asyncio.wrap_future(pending)
+            pending = None
+
+            if chunk:
+                # Look for the marker across the chunk boundary too.
+                tail = parts[-1][1 - len(_SNAPSHOT_MARKER):] if parts else ""
+                cut = (tail + chunk).rfind(_SNAPSHOT_MARKER)
+                if cut == -1:
+                    parts.append(chunk)
+                    continue
+                text = "".join(parts) + chunk
+                cut += len(text) - len(chunk) - len(tail) + 1
+                block = text[:cut]
+                parts = [text[cut:]]
+            else:
+                eof = True
+                block = "".join(parts)
+
+            (header, snapshots) = await _run(executor, _parse_block, block,
+                                             filename, line,
+                                             "desc" not in mdata)
+            if header is not None:
+                mdata.update(header)
+            line += block.count("\n")
+
+            for snapshot in snapshots:
+                yield snapshot
+                await asyncio.sleep(0)
+    finally:
+        if pending is not None and not pending.done():
+            # Don't close the file under the feet of the pending read.
+            pending.add_done_callback(lambda future: fd.close())
+        else:
+            fd.close()
+
+
+def _parse_block(block, filename, first_line, has_header):
+    """
+    Parse all the snapshots of a block, the first one also holding the header.
+    Returns the header fields, or None, and the snapshots. This may run in
+    another process, hence the plain arguments and results.
+    """
+    ctx = _BlockContext(block, filename, first_line)
+    header = None
+    if has_header:
+        header = {}
+        msparser._parse_header(ctx, header)
+
+    snapshots = []
+    snapshot = msparser._parse_snapshot(ctx)
+    while snapshot is not None:
+        snapshots.append(snapshot)
+        snapshot = msparser._parse_snapshot(ctx)
+    return (header, snapshots)
+
+
+def _close_opened(future):
+    if not future.cancelled() and future.exception() is None:
+        future.result().close()
+
+
+async def _run(executor, function, *args):
+    return await asyncio.wrap_future(executor.submit(function, *args))
@@ -14,7 +14,9 @@ except ImportError:
 import msparser
 import os
 import os.path
+import subprocess
 import sys
+import tempfile
 
 # Use unittest2 on versions older than Python 2.7.
 if sys.version_info[0] < 3 and sys.version_info[1] < 7:
@@ -22,6 +24,14 @@ if sys.version_info[0] < 3 and sys.version_info[1] < 7:
 else:
     from unittest import TestCase, main
 
+# The asyncio interface requires Python 3.6.
+if sys.version_info >= (3, 6):
+    import asyncio
+    import concurrent.futures
+    from msparser import aio
+else:
+    aio = None
+
 
 class FakeContext():
     def __init__(self, lines=[], filename="fake.txt", baseline=0):
@@ -259,27 +269,630 @@ class ParseSnapshotTest(TestCase):
             self.assertEqual(err.filename, self.ctx.filename())
 
 
+class RecoverTest(TestCase):
+    def make_snapshot(self, snapshot_id):
+        return [
+            "#-----------",
+            "snapshot=" + str(snapshot_id),
+            "#-----------",
+            "time=" + str(snapshot_id * 10),
+            "mem_heap_B=1000",
+            "mem_heap_extra_B=8",
+            "mem_stacks_B=0",
+            "heap_tree=detailed",
+            "n1: 1000 (heap allocation functions) malloc/new/new[], "
+            "--alloc-fns, etc.",
+            " n0: 1000 0x8048404: h (prog.c:4)"
+        ]
+
+    def parse_snapshots(self, lines):
+        ctx = FakeContext(lines, baseline=3)
+        mdata = {}
+        diagnostics = []
+        msparser._add_snapshots(mdata, msparser._recover_snapshots(
+            msparser._RecoveryContext(ctx), diagnostics))
+        return (mdata, diagnostics)
+
+    def test_truncated_tree(self):
+        lines = (self.make_snapshot(0) + self.make_snapshot(1) +
+                 self.make_snapshot(2)[:-1])
+        (mdata, diagnostics) = self.parse_snapshots(lines)
+        self.assertEqual([s["id"] for s in mdata["snapshots"]], [0, 1])
+        self.assertEqual(mdata["detailed_snapshot_indices"], [0, 1])
+        self.assertEqual(diagnostics, [{"line": 32,
+                                        "message": "unexpected EOF"}])
+
+    def test_resynchronize(self):
+        broken = self.make_snapshot(1)
+        del broken[4]
+        truncated = self.make_snapshot(2)[:7]
+        lines = (self.make_snapshot(0) + broken + truncated +
+                 self.make_snapshot(3))
+        (mdata, diagnostics) = self.parse_snapshots(lines)
+        self.assertEqual([s["id"] for s in mdata["snapshots"]], [0, 3])
+        self.assertEqual([d["line"] for d in diagnostics], [18, 31])
+        self.assertEqual(mdata["snapshots"][1]["time"], 30)
+
+    def test_parse_file(self):
+        path = os.path.join("test_data", "massif.out.5")
+        expected = msparser.parse_file(path)
+
+        actual = msparser.parse_file(path, recover=True)
+        self.assertEqual(actual.pop("diagnostics"), [])
+        self.assertEqual(expected, actual)
+
+        with open(path) as fd:
+            content = fd.read()
+        (handle, truncated_path) = tempfile.mkstemp()
+        try:
+            os.write(handle, content[:len(content) // 2].encode("ascii"))
+            os.close(handle)
+            self.assertRaises(msparser.ParseError,
+                              msparser.parse_file, truncated_path)
+            actual = msparser.parse_file(truncated_path, recover=True)
+        finally:
+            os.remove(truncated_path)
+
+        num_snapshots = len(actual["snapshots"])
+        self.assertTrue(num_snapshots > 0)
+        self.assertEqual(expected["snapshots"][:num_snapshots],
+                         actual["snapshots"])
+        self.assertEqual(len(actual["diagnostics"]), 1)
+
+    def test_truncated_line(self):
+        class TruncatedContext(FakeContext):
+            def readline(self):
+                line = FakeContext.readline(self)
+                if self.index_ == len(self.lines_):
+                    line = line.rstrip("\n")
+                return line
+
+        # Both would be valid lines, but the file doesn't end there.
+        for last_line in [" n0: 1000 ", " n0: 1000 0x"]:
+            lines = (self.make_snapshot(0) + self.make_snapshot(1)[:-1] +
+                     [last_line])
+            diagnostics = []
+            snapshots = list(msparser._recover_snapshots(
+                msparser._RecoveryContext(TruncatedContext(lines)),
+                diagnostics))
+            self.assertEqual([s["data"]["id"] for s in snapshots], [0])
+            self.assertEqual(diagnostics, [{"line": 20,
+                                            "message": "truncated line"}])
+
+    def test_truncated_at_every_byte(self):
+        path = os.path.join("test_data", "massif.out.0")
+        expected = msparser.parse_file(path)["snapshots"]
+        with open(path) as fd:
+            content = fd.read()
+
+        saved_speedups = msparser._speedups
+        (handle, truncated_path) = tempfile.mkstemp()
+        os.close(handle)
+        try:
+            for speedups in set([None, saved_speedups]):
+                msparser._speedups = speedups
+                for end in range(len(content) // 3, len(content) + 1):
+                    with open(truncated_path, "w") as fd:
+                        fd.write(content[:end])
+                    actual = msparser.parse_file(truncated_path, True)
+                    num_snapshots = len(actual["snapshots"])
+                    self.assertEqual(expected[:num_snapshots],
+                                     actual["snapshots"], end)
+                    if not content[:end].endswith("\n"):
+                        self.assertTrue(actual["diagnostics"], end)
+        finally:
+            msparser._speedups = saved_speedups
+            os.remove(truncated_path)
+
+
+class ProfileTest(TestCase):
+    def setUp(self):
+        times = [0, 10, 20, 20, 20, 35]
+        self.profile = msparser.Profile({
+            "snapshots": [{"id": 100 + i, "time": time}
+                          for (i, time) in enumerate(times)]
+        })
+
+    def ids(self, snapshots):
+        return [snapshot["id"] for snapshot in snapshots]
+
+    def test_dict_access(self):
+        path = os.path.join("test_data", "massif.out.0")
+        profile = msparser.parse_file(path)
+        self.assertTrue(isinstance(profile, msparser.Profile))
+        self.assertEqual(profile["cmd"], "./a.out")
+        with open(path + ".json") as fd:
+            self.assertEqual(json.load(fd), profile)
+
+    def test_snapshot_by_id(self):
+        self.assertEqual(self.profile.snapshot_by_id(103)["time"], 20)
+        self.assertRaises(KeyError, self.profile.snapshot_by_id, 99)
+
+    def test_snapshot_at(self):
+        snapshot_at = self.profile.snapshot_at
+        self.assertEqual(snapshot_at(-5)["id"], 100)
+        self.assertEqual(snapshot_at(4)["id"], 100)
+        self.assertEqual(snapshot_at(5)["id"], 100)
+        self.assertEqual(snapshot_at(6)["id"], 101)
+        self.assertEqual(snapshot_at(20)["id"], 104)
+        self.assertEqual(snapshot_at(27.5)["id"], 104)
+        self.assertEqual(snapshot_at(28)["id"], 105)
+        self.assertEqual(snapshot_at(1000)["id"], 105)
+        self.assertEqual(msparser.Profile({"snapshots": []}).snapshot_at(0),
+                         None)
+
+    def test_snapshots_between(self):
+        between = self.profile.snapshots_between
+        self.assertEqual(self.ids(between(10, 20)), [101, 102, 103, 104])
+        self.assertEqual(self.ids(between(11, 34)), [102, 103, 104])
+        self.assertEqual(self.ids(between(21, 34)), [])
+        self.assertEqual(self.ids(between(-10, 100)), list(range(100, 106)))
+
+    def test_unordered_times(self):
+        profile = msparser.Profile({"snapshots": [
+            {"id": 0, "time": 30}, {"id": 1, "time": 10},
+            {"id": 2, "time": 20}]})
+        self.assertEqual(profile.times, [10, 20, 30])
+        self.assertEqual(self.ids(profile.snapshots_between(15, 30)), [2, 0])
+        self.assertEqual(profile.snapshot_at(12)["id"], 1)
+
+
+class SnapshotStatsTest(TestCase):
+    def add_snapshots(self, values):
+        snapshots = []
+        for (index, (time, heap, extra, stack, is_peak)) in enumerate(values):
+            snapshots.append({
+                "is_detailed": is_peak,
+                "is_peak": is_peak,
+                "data": {
+                    "id": index,
+                    "time": time,
+                    "mem_heap": heap,
+                    "mem_heap_extra": extra,
+                    "mem_stack": stack,
+                    "heap_tree": None
+                }
+            })
+        mdata = {}
+        msparser._add_snapshots(mdata, snapshots)
+        return mdata
+
+    def test_true_peaks(self):
+        mdata = self.add_snapshots([
+            (0, 0, 0, 0, False),
+            (10, 100, 8, 50, True),
+            (20, 104, 8, 0, False),
+            (20, 90, 8, 100, False),
+            (40, 50, 0, 0, False)
+        ])
+        stats = mdata["stats"]
+        self.assertEqual(mdata["peak_snapshot_index"], 1)
+        self.assertEqual(stats["peak_heap_index"], 2)
+        self.assertEqual(stats["peak_heap"], 112)
+        self.assertEqual(stats["peak_total_index"], 3)
+        self.assertEqual(stats["peak_total"], 198)
+        self.assertEqual(stats["total_percentiles"],
+                         {"p50": 112, "p90": 198, "p95": 198, "p99": 198})
+        self.assertEqual(stats["growth_rates"],
+                         [None, 15.8, -4.6, None, -7.4])
+
+    def test_no_snapshot(self):
+        stats = self.add_snapshots([])["stats"]
+        self.assertEqual(stats["peak_heap_index"], None)
+        self.assertEqual(stats["peak_total"], None)
+        self.assertEqual(stats["total_percentiles"]["p50"], None)
+        self.assertEqual(stats["growth_rates"], [])
+
+
+class MergeTest(TestCase):
+    path = os.path.join("test_data", "massif.out.0")
+
+    def test_merge_sum(self):
+        mdata = msparser.parse_file(self.path)
+        peak = mdata["snapshots"][mdata["peak_snapshot_index"]]
+        merged = msparser.merge([self.path, self.path])
+
+        self.assertEqual(merged["runs"], 2)
+        self.assertEqual(merged["time_unit"], "ms")
+        self.assertEqual(merged["merged_peak_heap_tree"]["nbytes"],
+                         2 * peak["heap_tree"]["nbytes"])
+        # The merged tree doesn't belong to any of the merged snapshots.
+        self.assertEqual(merged["detailed_snapshot_indices"], [])
+        self.assertFalse("peak_snapshot_index" in merged)
+        self.assertEqual([s["heap_tree"] for s in merged["snapshots"]],
+                         [None] * 4)
+        self.assertEqual(merged["stats"]["peak_heap_index"], 2)
+        self.assertEqual([s["time"] for s in merged["snapshots"]],
+                         [0, 183, 184, 185])
+        self.assertEqual(merged["snapshots"][1]["mem_heap"], 2000)
+        self.assertEqual(merged["snapshots"][1]["mem_heap_extra"], 16)
+
+    def test_merge_average(self):
+        mdata = msparser.parse_file(self.path)
+        peak = mdata["snapshots"][mdata["peak_snapshot_index"]]
+        merged = msparser.merge([self.path] * 3, average=True)
+
+        def strip_addresses(node):
+            details = node["details"]
+            if details is not None:
+                details = dict(details, address=None)
+            return {
+                "nbytes": node["nbytes"],
+                "children": [strip_addresses(c) for c in node["children"]],
+                "details": details
+            }
+
+        self.assertEqual(merged["merged_peak_heap_tree"],
+                         strip_addresses(peak["heap_tree"]))
+        self.assertEqual(merged["snapshots"][-1]["mem_heap"],
+                         mdata["snapshots"][-1]["mem_heap"])
+
+    def test_merge_average_is_exact(self):
+        # 32000 * 49 * (1.0 / 49) isn't 32000.
+        single = msparser.merge([self.path])
+        merged = msparser.merge([self.path] * 49, average=True)
+        self.assertEqual(merged["snapshots"], single["snapshots"])
+        self.assertEqual(merged["merged_peak_heap_tree"],
+                         single["merged_peak_heap_tree"])
+
+    def test_merge_time_axis(self):
+        other = os.path.join("test_data", "massif.out.2")
+        merged = msparser.merge([other, os.path.join("test_data",
+                                                      "massif.out.3")])
+        first = msparser.parse_file(other)["snapshots"]
+        times = [s["time"] for s in merged["snapshots"]]
+        self.assertEqual(times, sorted(set(times)))
+        self.assertTrue(set(s["time"] for s in first) <= set(times))
+
+    def test_merge_in_parallel(self):
+        paths = [os.path.join("test_data", "massif.out." + str(i))
+                 for i in [2, 3, 6]]
+        self.assertEqual(msparser.merge(paths),
+                         msparser.merge(paths, workers=2))
+
+    def test_merge_recover(self):
+        with open(self.path) as fd:
+            content = fd.read()
+        (handle, truncated_path) = tempfile.mkstemp()
+        try:
+            os.write(handle, content[:len(content) // 2].encode("ascii"))
+            os.close(handle)
+            paths = [self.path, truncated_path]
+            self.assertRaises(msparser.ParseError, msparser.merge, paths)
+            merged = msparser.merge(paths, recover=True)
+            self.assertEqual(merged, msparser.merge(paths, workers=2,
+                                                    recover=True))
+            diagnostics = msparser.parse_file(truncated_path,
+                                              True)["diagnostics"]
+        finally:
+            os.remove(truncated_path)
+
+        self.assertEqual(merged["runs"], 2)
+        self.assertTrue(diagnostics)
+        self.assertEqual(merged["diagnostics"],
+                         [dict(d, path=truncated_path) for d in diagnostics])
+        self.assertFalse("diagnostics" in msparser.merge([self.path]))
+
+    def test_merge_different_time_units(self):
+        paths = [os.path.join("test_data", "massif.out." + str(i))
+                 for i in [0, 1]]
+        self.assertRaises(ValueError, msparser.merge, paths)
+
+
+class LeakSuspectsTest(TestCase):
+    def make_node(self, function, nbytes, children=[]):
+        return {
+            "nbytes": nbytes,
+            "children": children,
+            "details": {"address": "0x" + function, "function": function,
+                        "file": "prog.c", "line": 1}
+        }
+
+    def make_mdata(self, trees):
+        snapshots = []
+        for (time, children) in trees:
+            snapshots.append({"time": time, "heap_tree": {
+                "nbytes": sum(child["nbytes"] for child in children),
+                "children": children,
+                "details": None
+            }})
+        return {
+            "snapshots": snapshots,
+            "detailed_snapshot_indices": list(range(len(snapshots)))
+        }
+
+    def functions(self, suspects):
+        return [[d["function"] for d in s["path"]] for s in suspects]
+
+    def test_ranking(self):
+        node = self.make_node
+        suspects = msparser.leak_suspects(self.make_mdata([
+            (0, [node("a", 10, [node("main", 10)]),
+                 node("b", 50), node("c", 30)]),
+            (10, [node("a", 20, [node("main", 20)]),
+                  node("b", 40), node("c", 30)]),
+            (20, [node("a", 30, [node("main", 30)]),
+                  node("b", 70), node("c", 30), node("d", 5)]),
+        ]))
+        self.assertEqual(self.functions(suspects),
+                         [["a", "main"], ["a"], ["d"]])
+        self.assertAlmostEqual(suspects[0]["slope"], 1.0)
+        self.assertAlmostEqual(suspects[0]["r_squared"], 1.0)
+        self.assertEqual(suspects[0]["first_nbytes"], 10)
+        self.assertEqual(suspects[0]["last_nbytes"], 30)
+        self.assertAlmostEqual(suspects[2]["slope"], 0.25)
+
+    def test_vanishing_sites(self):
+        node = self.make_node
+        suspects = msparser.leak_suspects(self.make_mdata([
+            (0, [node("a", 10), node("b", 10)]),
+            (10, [node("b", 20)]),
+            (20, [node("a", 30), node("b", 30)]),
+            (30, [node("a", 40)]),
+        ]))
+        self.assertEqual(suspects, [])
+
+    def test_not_enough_snapshots(self):
+        mdata = self.make_mdata([(0, [self.make_node("a", 10)])])
+        self.assertEqual(msparser.leak_suspects(mdata), [])
+
+    def test_parsed_file(self):
+        path = os.path.join("test_data", "massif.out.0")
+        suspects = msparser.leak_suspects(msparser.parse_file(path))
+        self.assertEqual(suspects[0]["details"]["function"], "g")
+        self.assertEqual(suspects[0]["path"][0]["function"], "h")
+        for (first, second) in zip(suspects, suspects[1:]):
+            self.assertTrue(first["slope"] >= second["slope"])
+
+
+IMPORT_BENCHMARK = """
+import sys, time
+start = time.time()
+import %s
+elapsed = time.time() - start
+print(elapsed)
+print(" ".join(sorted(sys.modules)))
+"""
+
+
+class ImportTimeTest(TestCase):
+    # Generous bound on the best import time, which is a few milliseconds.
+    max_import_time = 0.25
+
+    def benchmark_import(self, module, runs=5):
+        """
+        Import module in fresh interpreters, returning the best import time
+        and the modules loaded by the last run.
+        """
+        best = None
+        for i in range(runs):
+            output = subprocess.Popen(
+                [sys.executable, "-c", IMPORT_BENCHMARK % module],
+                stdout=subprocess.PIPE).communicate()[0]
+            lines = output.decode("ascii").splitlines()
+            elapsed = float(lines[0])
+            if best is None or elapsed < best:
+                best = elapsed
+        return (best, lines[1].split())
+
+    def test_msparser_import(self):
+        (elapsed, modules) = self.benchmark_import("msparser")
+        self.assertTrue(elapsed < self.max_import_time, elapsed)
+        for module in ["re", "threading", "multiprocessing"]:
+            self.assertFalse(module in modules, module)
+
+    def test_msprint_import(self):
+        (elapsed, modules) = self.benchmark_import("msprint")
+        self.assertTrue(elapsed < self.max_import_time, elapsed)
+        for module in ["json", "optparse", "traceback", "sqlite3"]:
+            self.assertFalse(module in modules, module)
+
+    def test_lazy_regex(self):
+        regex = msparser._LazyRegex(r"\s*n(?P<data>\d+)")
+        self.assertFalse("match" in vars(regex))
+        self.assertEqual(regex.match("  n42").group("data"), "42")
+        self.assertTrue("match" in vars(regex))
+        self.assertEqual(regex.pattern, r"\s*n(?P<data>\d+)")
+
+
+class NativeScannerTest(TestCase):
+    def parse_heap_tree(self, lines, speedups):
+        saved_speedups = msparser._speedups
+        msparser._speedups = speedups
+        try:
+            ctx = FakeContext(lines)
+            return msparser._parse_heap_tree(ctx)
+        except msparser.ParseError:
+            err = sys.exc_info()[1]
+            return (str(err.msg), err.line)
+        finally:
+            msparser._speedups = saved_speedups
+
+    def assertSameResult(self, lines):
+        expected = self.parse_heap_tree(lines, None)
+        actual = self.parse_heap_tree(lines, msparser._speedups)
+        self.assertEqual(expected, actual)
+
+    def setUp(self):
+        if msparser._speedups is None:
+            self.skipTest("native scanner not built")
+
+    def test_tricky_details(self):
+        for details in [
+            "0x4C2B: malloc (vg_replace_malloc.c:270)",
+            "0x4C2B: malloc (in /usr/lib/libc.so)",
+            "0x4C2B: malloc (in :12)",
+            "0x4C2B: malloc (in )",
+            "0x4C2B: malloc (in)",
+            "0x4C2B: malloc (file.c:)",
+            "0x4C2B: f(int) (bar) (x.c:3)",
+            "0x4C2B: f(int) (a:b:3)",
+            "0x4C2B: f(int) (x.c:3a)",
+            "0x4C2B: f(int) (x.c:3)\r",
+            "0x4C2B: operator new(unsigned long) (x.c:3)",
+            "0x4C2B:\tmalloc\t(in\tfoo.so)",
+            "0x4C2B: ",
+            "0x4C2B:",
+            "0x4C2B: m",
+            "0x4C2B malloc",
+            ": malloc",
+            "0x4C2B: malloc (x.c:123456789012345678901234567890)",
+            "0x4C2B: caf\u00e9 (caf\u00e9.c:\u0664\u0662)",
+            "(heap allocation functions) malloc/new/new[], --alloc-fns, etc.",
+            "in 1 place, below massif's threshold (01.00%)",
+            ""
+        ]:
+            self.assertSameResult(["n0: 8 " + details])
+
+    def test_malformed_entries(self):
+        for line in [
+            "",
+            "n0:8 foo",
+            "n0: 8",
+            "n: 8 foo",
+            "x0: 8 foo",
+            "  n0: 123456789012345678901234567890 foo",
+            " \x1cn0:\t8\x1ffoo",
+            "n\u0661: 8 foo"
+        ]:
+            self.assertSameResult([line])
+
+    def test_unexpected_eof(self):
+        self.assertSameResult([])
+        self.assertSameResult(["n2: 16 foo", " n0: 8 bar"])
+
+
+class AsyncParseTest(TestCase):
+    path = os.path.join("test_data", "massif.out.1")
+
+    def setUp(self):
+        if aio is None:
+            self.skipTest("asyncio interface requires Python 3.6")
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def collect_snapshots(self, limit=None):
+        snapshots = []
+        iterator = aio.iter_snapshots(self.path, chunk_size=64)
+        while limit is None or len(snapshots) < limit:
+            try:
+                snapshots.append(
+                    self.loop.run_until_complete(iterator.__anext__()))
+            except StopAsyncIteration:
+                break
+        self.loop.run_until_complete(iterator.aclose())
+        return snapshots
+
+    def test_parse_file_small_chunks(self):
+        for chunk_size in [9, 10, 11, 4096]:
+            actual = self.loop.run_until_complete(
+                aio.parse_file(self.path, chunk_size=chunk_size))
+            self.assertEqual(msparser.parse_file(self.path), actual)
+
+    def test_iter_snapshots(self):
+        expected = msparser.parse_file(self.path)["snapshots"]
+        self.assertEqual(expected, self.collect_snapshots())
+        self.assertEqual(expected[:3], self.collect_snapshots(3))
+
+    def test_early_exit_closes_file(self):
+        opened = []
+
+        def recording_open(path):
+            fd = open(path)
+            opened.append(fd)
+            return fd
+
+        aio.open = recording_open
+        try:
+            self.assertEqual(len(self.collect_snapshots(2)), 2)
+        finally:
+            del aio.open
+        self.assertEqual(len(opened), 1)
+        self.assertTrue(opened[0].closed)
+
+    def test_concurrent_parses(self):
+        paths = [os.path.join("test_data", "massif.out." + str(i))
+                 for i in range(7)]
+        tasks = [self.loop.create_task(aio.parse_file(path, chunk_size=512))
+                 for path in paths]
+        actual = [self.loop.run_until_complete(task) for task in tasks]
+        self.assertEqual([msparser.parse_file(p) for p in paths], actual)
+
+    def test_process_executor(self):
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=2)
+        try:
+            actual = self.loop.run_until_complete(
+                aio.parse_file(self.path, executor, chunk_size=512))
+            self.assertEqual(msparser.parse_file(self.path), actual)
+        finally:
+            executor.shutdown()
+
+    def test_parse_error(self):
+        lines = ["desc: --time-unit=B", "cmd: ./a.out", "time_unit: B",
+                 "#-----------", "snapshot=0", "#-----------", "time=0",
+                 "mem_heap_B=0", "mem_heap_extra_B=0", "mem_stacks_B=0",
+                 "heap_tree=detailed", "n1: 8 (heap allocation functions)"]
+        (handle, self.path) = tempfile.mkstemp()
+        os.write(handle, ("\n".join(lines) + "\n").encode("ascii"))
+        os.close(handle)
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=1)
+        try:
+            # Errors raised in another process are the same.
+            for pool in [None, executor]:
+                try:
+                    self.loop.run_until_complete(
+                        aio.parse_file(self.path, pool))
+                    self.fail("ParseError should have been thrown.")
+                except msparser.ParseError:
+                    err = sys.exc_info()[1]
+                    self.assertEqual(err.line, 13)
+                    self.assertEqual(err.filename,
+                                     os.path.abspath(self.path))
+        finally:
+            executor.shutdown()
+            os.remove(self.path)
+
+    def test_cancellation(self):
+        task = self.loop.create_task(aio.parse_file(self.path, chunk_size=1))
+        self.loop.call_soon(task.cancel)
+        self.assertRaises(asyncio.CancelledError,
+                          self.loop.run_until_complete, task)
+
+
 class TestFullParse(TestCase):
     pass
 
 
-def make_parse_test(path_to_actual, path_to_expected):
+def make_parse_test(path_to_actual, path_to_expected, native):
     def test_parse(self):
-        actual = msparser.parse_file(path_to_actual)
+        if native and msparser._speedups is None:
+            self.skipTest("native scanner not built")
+        saved_speedups = msparser._speedups
+        if not native:
+            msparser._speedups = None
+        try:
+            actual = msparser.parse_file(path_to_actual)
+        finally:
+            msparser._speedups = saved_speedups
         with open(path_to_expected) as fd_to_expected:
             expected = json.load(fd_to_expected)
         self.assertEqual(expected, actual)
     return test_parse
 
 
+# Each data file is parsed with both the native and the pure Python backends.
 for filename in os.listdir("test_data"):
     if not filename.endswith("json"):
         path_to_actual = os.path.join("test_data", filename)
         path_to_expected = path_to_actual + ".json"
-        test_name = "test" + filename.replace(".", "_")
-        test_function = make_parse_test(path_to_actual, path_to_expected)
-        test_function.__doc__ = test_name
-        setattr(TestFullParse, test_name, test_function)
+        for (suffix, native) in [("_native", True), ("_python", False)]:
+            test_name = "test" + filename.replace(".", "_") + suffix
+            test_function = make_parse_test(path_to_actual,
+                                             path_to_expected, native)
+            test_function.__doc__ = test_name
+            setattr(TestFullParse, test_name, test_function)
 
 
 if __name__ == "__main__":
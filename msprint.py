@@ -3,13 +3,11 @@
 # Copyright (c) 2011 Mathieu Turcotte
 # Licensed under the MIT license.
 
-import json
+# Only import what every invocation needs, json, optparse and traceback are
+# imported where they are used.
 import msparser
-import optparse
 import os
-import re
 import sys
-import traceback
 
 
 def inst_unit_scaling(peak):
@@ -73,6 +71,7 @@ def print_as_json(mdata, indent):
     """
     Print mdata as json. If indent is true, the outputed json is indented.
     """
+    import json
     if indent:
         print(json.dumps(mdata, indent=1))
     else:
@@ -96,6 +95,91 @@ def print_gnuplot_dtable(mdata):
         print("  " + str(id), time, heap, extra, total, stack, sep="\t")
 
 
+def format_details(details):
+    if details["file"] is None:
+        return details["function"]
+    elif details["line"] is None:
+        return "%s (%s)" % (details["function"], details["file"])
+    return "%s (%s:%d)" % (details["function"], details["file"],
+                           details["line"])
+
+
+def print_leak_suspects(mdata):
+    """
+    Print the call sites whose memory grows steadily, most suspect first. The
+    call stack of each site is printed from the allocation function down.
+    """
+    print("# msprint.py - (C) Mathieu Turcotte, 2011")
+    print("# valgrind --tool=massif", mdata["desc"], mdata["cmd"])
+    print("# rank", "B/" + mdata["time_unit"], "r2", "first", "last",
+          "call stack", sep="\t")
+    suspects = msparser.leak_suspects(mdata)
+    for (rank, suspect) in enumerate(suspects):
+        stack = " <- ".join(format_details(d) for d in suspect["path"])
+        print("  " + str(rank + 1), "%.6g" % suspect["slope"],
+              "%.3f" % suspect["r_squared"], suspect["first_nbytes"],
+              suspect["last_nbytes"], stack, sep="\t")
+
+
+def print_graphviz_script(mdata, snapshot_id=None):
+    """
+    Print the heap tree of a snapshot as a Graphviz script. When snapshot_id
+    is None, the peak snapshot is used, or the merged peak heap tree of a
+    merged profile.
+    """
+    if snapshot_id is None and mdata.get("merged_peak_heap_tree") is not None:
+        # The runs peaked at different times, so the merged tree has no time.
+        graph = "merged_peak"
+        root = "merged peak of %d runs" % mdata["runs"]
+        heap_tree = mdata["merged_peak_heap_tree"]
+    else:
+        if snapshot_id is None:
+            if "peak_snapshot_index" not in mdata:
+                print("No peak snapshot, use --snapshot.", file=sys.stderr)
+                return
+            snapshot = mdata["snapshots"][mdata["peak_snapshot_index"]]
+        else:
+            try:
+                snapshot = mdata.snapshot_by_id(snapshot_id)
+            except KeyError:
+                print("No snapshot", snapshot_id, file=sys.stderr)
+                return
+
+        if snapshot["heap_tree"] is None:
+            print("Snapshot", snapshot["id"], "isn't detailed.",
+                  file=sys.stderr)
+            return
+
+        graph = "snapshot_%d" % snapshot["id"]
+        root = "time=%d" % snapshot["time"]
+        heap_tree = snapshot["heap_tree"]
+
+    print("// msprint.py - (C) Mathieu Turcotte, 2011")
+    print("digraph %s {" % graph)
+    print("    node [shape=box];")
+
+    node_id = 0
+    stack = [(heap_tree, None)]
+    while stack:
+        (node, parent_id) = stack.pop()
+        if parent_id is None:
+            name = root
+        elif node["details"] is None:
+            name = "below threshold"
+        else:
+            name = format_details(node["details"])
+        label = "%s\\n%d B" % (name.replace("\\", "\\\\")
+                                    .replace('"', '\\"'), node["nbytes"])
+        print('    n%d [label="%s"];' % (node_id, label))
+        if parent_id is not None:
+            print("    n%d -> n%d;" % (parent_id, node_id))
+        for child in reversed(node["children"]):
+            stack.append((child, node_id))
+        node_id += 1
+
+    print("}")
+
+
 GNUPLOT_HEADER = """\
 # msprint.py - (C) Mathieu Turcotte, 2011
 # yscale: {yscale}
@@ -173,8 +257,187 @@ def print_gnuplot_script(mdata, filename, format="png", xsize=1024, ysize=768):
     print("end")
 
 
-def parse_args():
-    usage = "usage: %prog [options] massif-out-file"
+SQLITE_SCHEMA = """\
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    path TEXT,
+    desc TEXT,
+    cmd TEXT,
+    time_unit TEXT,
+    peak_snapshot_id INTEGER REFERENCES snapshots (id),
+    merged_heap_tree_id INTEGER REFERENCES heap_nodes (id)
+);
+CREATE TABLE IF NOT EXISTS snapshots (
+    id INTEGER PRIMARY KEY,
+    run_id INTEGER NOT NULL REFERENCES runs (id),
+    snapshot INTEGER NOT NULL,
+    time INTEGER NOT NULL,
+    mem_heap INTEGER NOT NULL,
+    mem_heap_extra INTEGER NOT NULL,
+    mem_stack INTEGER NOT NULL,
+    is_detailed INTEGER NOT NULL,
+    is_peak INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS frames (
+    id INTEGER PRIMARY KEY,
+    address TEXT,
+    function TEXT,
+    file TEXT,
+    line INTEGER
+);
+CREATE TABLE IF NOT EXISTS heap_nodes (
+    id INTEGER PRIMARY KEY,
+    snapshot_id INTEGER REFERENCES snapshots (id),
+    parent_id INTEGER REFERENCES heap_nodes (id),
+    frame_id INTEGER REFERENCES frames (id),
+    nbytes INTEGER NOT NULL
+);
+"""
+
+SQLITE_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS snapshots_run_time "
+    "ON snapshots (run_id, time)",
+    "CREATE INDEX IF NOT EXISTS frames_function ON frames (function)",
+    "CREATE INDEX IF NOT EXISTS frames_file_line ON frames (file, line)",
+    "CREATE INDEX IF NOT EXISTS heap_nodes_snapshot "
+    "ON heap_nodes (snapshot_id)",
+    "CREATE INDEX IF NOT EXISTS heap_nodes_parent ON heap_nodes (parent_id)",
+    "CREATE INDEX IF NOT EXISTS heap_nodes_frame "
+    "ON heap_nodes (frame_id, nbytes)"
+]
+
+SQLITE_INSERTS = {
+    "runs": "INSERT INTO runs VALUES (?, ?, ?, ?, ?, ?, ?)",
+    "snapshots": "INSERT INTO snapshots VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+    "frames": "INSERT INTO frames VALUES (?, ?, ?, ?, ?)",
+    "heap_nodes": "INSERT INTO heap_nodes VALUES (?, ?, ?, ?, ?)"
+}
+
+
+class SQLiteExporter(object):
+    """
+    Bulk load mdata into a SQLite database. Rows are inserted in batches, all
+    the runs are loaded in a single transaction and the indexes are only
+    created once the data is in. Heap trees are stored as heap_nodes rows
+    pointing to their parent, while the details of the nodes are shared
+    between runs through the frames table. The merged peak heap tree of a
+    merged profile belongs to no snapshot: its nodes have a NULL snapshot_id
+    and its root is referenced by the merged_heap_tree_id of the run.
+    """
+    def __init__(self, path, batch_size=10000):
+        import sqlite3
+
+        self.db = sqlite3.connect(path, isolation_level=None)
+        self.db.executescript(SQLITE_SCHEMA)
+        self.db.execute("BEGIN")
+        self.batch_size = batch_size
+
+        # Ids are allocated here so that rows can reference each other
+        # before being inserted.
+        self.next_ids = {}
+        self.rows = {}
+        for table in SQLITE_INSERTS:
+            max_id = self.db.execute("SELECT MAX(id) FROM " + table)
+            self.next_ids[table] = (max_id.fetchone()[0] or 0) + 1
+            self.rows[table] = []
+
+        self.frames = {}
+        for row in self.db.execute("SELECT address, function, file, line, id "
+                                   "FROM frames"):
+            self.frames[row[:4]] = row[4]
+
+    def allocate_id(self, table):
+        row_id = self.next_ids[table]
+        self.next_ids[table] += 1
+        return row_id
+
+    def insert(self, table, row):
+        rows = self.rows[table]
+        rows.append(row)
+        if len(rows) >= self.batch_size:
+            self.flush(table)
+
+    def flush(self, table):
+        self.db.executemany(SQLITE_INSERTS[table], self.rows[table])
+        self.rows[table] = []
+
+    def frame_id(self, details):
+        if details is None:
+            return None
+        key = (details["address"], details["function"], details["file"],
+               details["line"])
+        frame_id = self.frames.get(key)
+        if frame_id is None:
+            frame_id = self.allocate_id("frames")
+            self.frames[key] = frame_id
+            self.insert("frames", (frame_id,) + key)
+        return frame_id
+
+    def load(self, path, mdata):
+        """
+        Load the data of a single massif.out file. The path of merged profiles
+        is None, which is stored as NULL.
+        """
+        run_id = self.allocate_id("runs")
+        peak_index = mdata.get("peak_snapshot_index")
+        peak_snapshot_id = None
+
+        for (index, snapshot) in enumerate(mdata["snapshots"]):
+            snapshot_id = self.allocate_id("snapshots")
+            if index == peak_index:
+                peak_snapshot_id = snapshot_id
+            heap_tree = snapshot["heap_tree"]
+            self.insert("snapshots", (
+                snapshot_id, run_id, snapshot["id"], snapshot["time"],
+                snapshot["mem_heap"], snapshot["mem_heap_extra"],
+                snapshot["mem_stack"], heap_tree is not None,
+                index == peak_index))
+            if heap_tree is not None:
+                self.load_heap_tree(snapshot_id, heap_tree)
+
+        merged_heap_tree_id = None
+        if mdata.get("merged_peak_heap_tree") is not None:
+            merged_heap_tree_id = self.load_heap_tree(
+                None, mdata["merged_peak_heap_tree"])
+
+        if path is not None:
+            path = os.path.abspath(path)
+        self.insert("runs", (run_id, path, mdata["desc"],
+                             mdata["cmd"], mdata["time_unit"],
+                             peak_snapshot_id, merged_heap_tree_id))
+
+    def load_heap_tree(self, snapshot_id, heap_tree):
+        """
+        Load the nodes of heap_tree and return the id of its root.
+        """
+        root_id = self.next_ids["heap_nodes"]
+        stack = [(heap_tree, None)]
+        while stack:
+            (node, parent_id) = stack.pop()
+            node_id = self.allocate_id("heap_nodes")
+            self.insert("heap_nodes", (
+                node_id, snapshot_id, parent_id,
+                self.frame_id(node["details"]), node["nbytes"]))
+            for child in reversed(node["children"]):
+                stack.append((child, node_id))
+        return root_id
+
+    def close(self):
+        """
+        Insert the remaining rows, create the indexes and commit.
+        """
+        for table in SQLITE_INSERTS:
+            self.flush(table)
+        for statement in SQLITE_INDEXES:
+            self.db.execute(statement)
+        self.db.execute("COMMIT")
+        self.db.close()
+
+
+def parse_args(argv=None):
+    import optparse
+
+    usage = "usage: %prog [options] massif-out-file..."
     description = "Extraction utility for the massif.out data format."
     version = "%prog 1.0"
 
@@ -184,10 +447,18 @@ def parse_args():
     argparser.add_option("-o", "--output",
                          dest="output",
                          default="table",
-                         choices=["json", "gnuplot", "table", "graphviz"],
+                         choices=["json", "gnuplot", "table", "graphviz",
+                                  "sqlite", "leaks"],
                          metavar="F",
                          help="specify the output format: "
-                              "json, gnuplot, graphviz or table")
+                              "json, gnuplot, graphviz, table, sqlite "
+                              "or leaks")
+
+    argparser.add_option("-r", "--recover",
+                         action="store_true",
+                         dest="recover",
+                         help="keep the complete snapshots of truncated or "
+                              "corrupted files, reporting the errors")
 
     json_group = optparse.OptionGroup(argparser, "JSON Options")
     json_group.add_option("-i", "--indent",
@@ -196,6 +467,15 @@ def parse_args():
                           help="indent the json output")
     argparser.add_option_group(json_group)
 
+    batch_group = optparse.OptionGroup(argparser, "Batch Options")
+    batch_group.add_option("-b", "--batch",
+                           dest="batch",
+                           metavar="LISTFILE",
+                           help="also process the files listed in LISTFILE, "
+                                "one path per line, or on the standard "
+                                "input if LISTFILE is -")
+    argparser.add_option_group(batch_group)
+
     graphviz_group = optparse.OptionGroup(argparser, "Graphviz Options")
     graphviz_group.add_option("--snapshot",
                               type="int",
@@ -227,13 +507,47 @@ def parse_args():
                              help="plot vertical size")
     argparser.add_option_group(gnuplot_group)
 
+    merge_group = optparse.OptionGroup(argparser, "Merge Options")
+    merge_group.add_option("-m", "--merge",
+                           action="store_true",
+                           dest="merge",
+                           help="merge all the files into a single profile")
+    merge_group.add_option("-a", "--average",
+                           action="store_true",
+                           dest="average",
+                           help="average the merged values instead of "
+                                "summing them")
+    merge_group.add_option("-j", "--jobs",
+                           type="int",
+                           dest="jobs",
+                           default=1,
+                           metavar="N",
+                           help="number of processes parsing the files")
+    argparser.add_option_group(merge_group)
+
+    sqlite_group = optparse.OptionGroup(argparser, "SQLite Options")
+    sqlite_group.add_option("-d", "--database",
+                            dest="database",
+                            metavar="DB",
+                            help="load the data into the given SQLite "
+                                 "database, created if needed, required "
+                                 "by the sqlite output")
+    argparser.add_option_group(sqlite_group)
+
     # - options contains optional arguments
     # - args contains positional arguments
-    (options, args) = argparser.parse_args()
+    (options, args) = argparser.parse_args(argv)
 
-    if len(args) == 0:
+    if len(args) == 0 and options.batch is None:
         argparser.error("No input file !")
 
+    if options.output == "sqlite" and options.database is None:
+        argparser.error("The sqlite output requires --database !")
+
+    # Merged profiles have no detailed snapshots to look for trends in.
+    if options.output == "leaks" and options.merge:
+        argparser.error("The leaks output can't be used with --merge !")
+
     for path in args[0:]:
         if os.path.isfile(path) is False:
             argparser.error(path)
@@ -241,22 +555,89 @@ def parse_args():
     return (options, args)
 
 
+def input_paths(options, args):
+    """
+    Yield the paths given on the command line followed by the ones listed in
+    the batch file, if any. Listed paths which aren't files are reported and
+    skipped rather than aborting the whole batch.
+    """
+    for path in args:
+        yield path
+
+    if options.batch is None:
+        return
+
+    if options.batch == "-":
+        listfile = sys.stdin
+    else:
+        listfile = open(options.batch)
+
+    try:
+        for line in listfile:
+            path = line.strip()
+            if not path:
+                continue
+            if os.path.isfile(path):
+                yield path
+            else:
+                print("No such file:", path, file=sys.stderr)
+    finally:
+        if listfile is not sys.stdin:
+            listfile.close()
+
+
+def output(options, exporter, path, mdata):
+    """
+    Output mdata, parsed from path, in the format selected by the options.
+    The path of merged profiles is None.
+    """
+    if options.output == "json":
+        print_as_json(mdata, options.indent)
+    elif options.output == "gnuplot":
+        print_gnuplot_script(mdata, os.path.basename(path or "merged"),
+                             options.format, options.xsize,
+                             options.ysize)
+    elif options.output == "table":
+        print_gnuplot_dtable(mdata)
+    elif options.output == "graphviz":
+        print_graphviz_script(mdata, options.snapshot)
+    elif options.output == "sqlite":
+        exporter.load(path, mdata)
+    elif options.output == "leaks":
+        print_leak_suspects(mdata)
+
+
 def main():
     (options, args) = parse_args()
 
-    for path in args[0:]:
+    exporter = None
+    if options.output == "sqlite":
+        exporter = SQLiteExporter(options.database)
+
+    if options.merge:
         try:
-            mdata = msparser.parse_file(path)
-            if options.output == "json":
-                print_as_json(mdata, options.indent)
-            elif options.output == "gnuplot":
-                print_gnuplot_script(mdata, os.path.basename(path),
-                                     options.format, options.xsize,
-                                     options.ysize)
-            elif options.output == "table":
-                print_gnuplot_dtable(mdata)
-        except ParseError as perr:
-            print(perr, file=sys.stderr)
+            paths = list(input_paths(options, args))
+            mdata = msparser.merge(paths, options.jobs, options.average,
+                                   options.recover)
+            for diagnostic in mdata.get("diagnostics", []):
+                print(diagnostic["path"], "line", diagnostic["line"],
+                      diagnostic["message"], file=sys.stderr)
+            output(options, exporter, None, mdata)
+        except (msparser.ParseError, ValueError) as err:
+            print(err, file=sys.stderr)
+    else:
+        for path in input_paths(options, args):
+            try:
+                mdata = msparser.parse_file(path, options.recover)
+                for diagnostic in mdata.get("diagnostics", []):
+                    print(path, "line", diagnostic["line"],
+                          diagnostic["message"], file=sys.stderr)
+                output(options, exporter, path, mdata)
+            except msparser.ParseError as perr:
+                print(perr, file=sys.stderr)
+
+    if exporter is not None:
+        exporter.close()
 
 
 if __name__ == "__main__":
@@ -265,4 +646,5 @@ if __name__ == "__main__":
     except KeyboardInterrupt:
         pass
     except Exception as err:
+        import traceback
         traceback.print_exc(file=sys.stdout)
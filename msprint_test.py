@@ -0,0 +1,429 @@
+# Copyright (c) 2011 Mathieu Turcotte
+# Licensed under the MIT license.
+
+# Enable with statement in Python 2.5.
+# This has to be the first statement.
+from __future__ import with_statement
+
+import msparser
+import msprint
+import os
+import os.path
+import json
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+
+# Use unittest2 on versions older than Python 2.7.
+if sys.version_info[0] < 3 and sys.version_info[1] < 7:
+    from unittest2 import TestCase, main
+else:
+    from unittest import TestCase, main
+
+
+def data_path(index):
+    return os.path.join("test_data", "massif.out." + str(index))
+
+
+def run_msprint(args, stdin=None):
+    process = subprocess.Popen([sys.executable, "msprint.py"] + args,
+                               stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE)
+    (stdout, stderr) = process.communicate(stdin)
+    return (stdout.decode("ascii"), stderr.decode("ascii"))
+
+
+def count_nodes(heap_tree):
+    return 1 + sum(count_nodes(child) for child in heap_tree["children"])
+
+
+def collect_frames(heap_tree, frames):
+    details = heap_tree["details"]
+    if details is not None:
+        frames.add((details["address"], details["function"],
+                    details["file"], details["line"]))
+    for child in heap_tree["children"]:
+        collect_frames(child, frames)
+
+
+class SQLiteExporterTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.database = os.path.join(self.directory, "massif.sqlite")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def load(self, paths):
+        exporter = msprint.SQLiteExporter(self.database, batch_size=16)
+        for path in paths:
+            exporter.load(path, msparser.parse_file(path))
+        exporter.close()
+
+    def query(self, sql, *args):
+        db = sqlite3.connect(self.database)
+        try:
+            return db.execute(sql, args).fetchall()
+        finally:
+            db.close()
+
+    def test_row_counts(self):
+        paths = [data_path(i) for i in range(7)]
+        self.load(paths)
+
+        num_snapshots = 0
+        num_nodes = 0
+        frames = set()
+        for path in paths:
+            for snapshot in msparser.parse_file(path)["snapshots"]:
+                num_snapshots += 1
+                if snapshot["heap_tree"] is not None:
+                    num_nodes += count_nodes(snapshot["heap_tree"])
+                    collect_frames(snapshot["heap_tree"], frames)
+
+        self.assertEqual(self.query("SELECT COUNT(*) FROM runs"), [(7,)])
+        self.assertEqual(self.query("SELECT COUNT(*) FROM snapshots"),
+                         [(num_snapshots,)])
+        self.assertEqual(self.query("SELECT COUNT(*) FROM heap_nodes"),
+                         [(num_nodes,)])
+        # Frames are shared by all the nodes with the same details.
+        self.assertEqual(self.query("SELECT COUNT(*) FROM frames"),
+                         [(len(frames),)])
+
+    def test_heap_tree_links(self):
+        path = data_path(0)
+        mdata = msparser.parse_file(path)
+        self.load([path])
+
+        peak = mdata["snapshots"][mdata["peak_snapshot_index"]]
+        rows = self.query("SELECT s.snapshot, s.is_peak FROM runs r "
+                          "JOIN snapshots s ON s.id = r.peak_snapshot_id")
+        self.assertEqual(rows, [(peak["id"], 1)])
+
+        def build_tree(node_id, nbytes, frame_id):
+            details = None
+            if frame_id is not None:
+                row = self.query("SELECT address, function, file, line "
+                                 "FROM frames WHERE id = ?", frame_id)[0]
+                details = {"address": row[0], "function": row[1],
+                           "file": row[2], "line": row[3]}
+            children = [build_tree(*row) for row in self.query(
+                "SELECT id, nbytes, frame_id FROM heap_nodes "
+                "WHERE parent_id = ? ORDER BY id", node_id)]
+            return {"nbytes": nbytes, "children": children,
+                    "details": details}
+
+        roots = self.query("SELECT n.id, n.nbytes, n.frame_id "
+                           "FROM heap_nodes n "
+                           "JOIN runs r ON r.peak_snapshot_id = n.snapshot_id "
+                           "WHERE n.parent_id IS NULL")
+        self.assertEqual(len(roots), 1)
+        self.assertEqual(build_tree(*roots[0]), peak["heap_tree"])
+
+    def test_load_into_existing_database(self):
+        path = data_path(0)
+        self.load([path])
+        (num_nodes, max_node_id) = self.query(
+            "SELECT COUNT(*), MAX(id) FROM heap_nodes")[0]
+        num_frames = self.query("SELECT COUNT(*) FROM frames")[0][0]
+
+        self.load([path])
+        self.assertEqual(self.query("SELECT id FROM runs ORDER BY id"),
+                         [(1,), (2,)])
+        self.assertEqual(self.query("SELECT COUNT(*), MIN(id), MAX(id) "
+                                    "FROM heap_nodes WHERE id > ?",
+                                    max_node_id),
+                         [(num_nodes, max_node_id + 1,
+                           max_node_id + num_nodes)])
+        self.assertEqual(self.query("SELECT COUNT(*) FROM frames"),
+                         [(num_frames,)])
+        self.assertEqual(self.query("SELECT COUNT(DISTINCT run_id) "
+                                    "FROM snapshots"), [(2,)])
+
+    def test_call_site_query(self):
+        self.load([data_path(i) for i in range(7)])
+        # The query documented in the README.
+        query = ("SELECT DISTINCT s.run_id "
+                 "FROM frames f "
+                 "JOIN heap_nodes n ON n.frame_id = f.id "
+                 "JOIN snapshots s ON s.id = n.snapshot_id "
+                 "WHERE f.file = 'prog.c' AND f.line = 4 AND n.nbytes > ?")
+        self.assertEqual(self.query(query, 10000), [(1,)])
+        self.assertEqual(self.query(query, 12000), [])
+        self.assertEqual(self.query("SELECT path FROM runs WHERE id = 1"),
+                         [(os.path.abspath(data_path(0)),)])
+
+        plan = " ".join(str(row) for row in self.query(
+            "EXPLAIN QUERY PLAN SELECT n.id FROM frames f "
+            "JOIN heap_nodes n ON n.frame_id = f.id "
+            "WHERE f.file = 'prog.c' AND f.line = 4 AND n.nbytes > 10000"))
+        self.assertTrue("frames_file_line" in plan, plan)
+        self.assertTrue("heap_nodes_frame" in plan, plan)
+
+    def test_database_option_required(self):
+        stderr = sys.stderr
+        sys.stderr = open(os.devnull, "w")
+        try:
+            self.assertRaises(SystemExit, msprint.parse_args,
+                              ["-o", "sqlite", data_path(0)])
+        finally:
+            sys.stderr.close()
+            sys.stderr = stderr
+        (options, args) = msprint.parse_args(
+            ["-o", "sqlite", "-d", self.database, data_path(0)])
+        self.assertEqual(options.database, self.database)
+
+
+class MergeOutputTest(TestCase):
+    paths = [data_path(i) for i in [2, 3, 6]]
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_merge_json(self):
+        (stdout, stderr) = run_msprint(["--merge", "-o", "json"] +
+                                       self.paths)
+        self.assertEqual(stderr, "")
+        expected = json.loads(json.dumps(msparser.merge(self.paths)))
+        self.assertEqual(json.loads(stdout), expected)
+
+    def test_merge_jobs(self):
+        (stdout, stderr) = run_msprint(["--merge", "-o", "json"] +
+                                       self.paths)
+        (parallel_stdout, parallel_stderr) = run_msprint(
+            ["--merge", "--jobs", "2", "-o", "json"] + self.paths)
+        self.assertEqual(parallel_stderr, "")
+        self.assertEqual(parallel_stdout, stdout)
+
+    def test_merge_average(self):
+        (stdout, stderr) = run_msprint(["--merge", "--average",
+                                        "-o", "table"] + [data_path(0)] * 3)
+        self.assertEqual(stderr, "")
+        rows = [line.split("\t")[1:4] for line in stdout.splitlines()
+                if not line.startswith("#")]
+        merged = msparser.merge([data_path(0)], average=True)
+        self.assertEqual([[float(value) for value in row] for row in rows],
+                         [[s["time"], s["mem_heap"], s["mem_heap_extra"]]
+                          for s in merged["snapshots"]])
+
+    def test_merge_different_time_units(self):
+        (stdout, stderr) = run_msprint(["--merge", "-o", "table",
+                                        data_path(0), data_path(1)])
+        self.assertEqual(stdout, "")
+        self.assertEqual(stderr.strip(),
+                         "can't merge files with different time units")
+
+    def test_merge_sqlite(self):
+        database = os.path.join(self.directory, "massif.sqlite")
+        (stdout, stderr) = run_msprint(["--merge", "-o", "sqlite",
+                                        "-d", database] + self.paths)
+        self.assertEqual(stderr, "")
+
+        merged = msparser.merge(self.paths)
+        heap_tree = merged["merged_peak_heap_tree"]
+        db = sqlite3.connect(database)
+        try:
+            # A merged profile has no single path nor peak snapshot.
+            self.assertEqual(db.execute("SELECT path, peak_snapshot_id "
+                                        "FROM runs").fetchall(),
+                             [(None, None)])
+            self.assertEqual(db.execute("SELECT COUNT(*) FROM snapshots "
+                                        "WHERE is_detailed").fetchall(),
+                             [(0,)])
+            # The merged tree belongs to the run, not to a snapshot.
+            root = db.execute("SELECT n.nbytes, n.parent_id, n.snapshot_id "
+                              "FROM runs r JOIN heap_nodes n "
+                              "ON n.id = r.merged_heap_tree_id").fetchall()
+            num_nodes = db.execute("SELECT COUNT(*) FROM heap_nodes "
+                                   "WHERE snapshot_id IS NULL").fetchall()
+        finally:
+            db.close()
+        self.assertEqual(root, [(heap_tree["nbytes"], None, None)])
+        self.assertEqual(num_nodes, [(count_nodes(heap_tree),)])
+
+
+class RecoverTest(TestCase):
+    def setUp(self):
+        with open(data_path(0)) as fd:
+            content = fd.read()
+        (handle, self.path) = tempfile.mkstemp()
+        os.write(handle, content[:len(content) // 2].encode("ascii"))
+        os.close(handle)
+        self.diagnostics = msparser.parse_file(self.path,
+                                               True)["diagnostics"]
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def expected_stderr(self):
+        return ["%s line %d %s" % (self.path, d["line"], d["message"])
+                for d in self.diagnostics]
+
+    def test_recover(self):
+        (stdout, stderr) = run_msprint(["-o", "table", self.path])
+        self.assertEqual(stdout, "")
+        self.assertTrue(" in " + os.path.abspath(self.path) in stderr,
+                        stderr)
+
+        (stdout, stderr) = run_msprint(["-r", "-o", "table", self.path])
+        self.assertTrue(self.diagnostics)
+        self.assertEqual(stderr.splitlines(), self.expected_stderr())
+        self.assertTrue(stdout.startswith("# "))
+
+    def test_merge_recover(self):
+        (stdout, stderr) = run_msprint(["--merge", "-o", "table",
+                                        data_path(0), self.path])
+        self.assertEqual(stdout, "")
+        self.assertTrue(" in " + os.path.abspath(self.path) in stderr,
+                        stderr)
+
+        (stdout, stderr) = run_msprint(["--merge", "-r", "-o", "table",
+                                        data_path(0), self.path])
+        self.assertEqual(stderr.splitlines(), self.expected_stderr())
+        self.assertTrue(stdout.startswith("# "))
+
+
+class LeakSuspectsOutputTest(TestCase):
+    def parse_rows(self, stdout):
+        return [line.split("\t") for line in stdout.splitlines()
+                if not line.startswith("#")]
+
+    def test_print_leak_suspects(self):
+        (stdout, stderr) = run_msprint(["-o", "leaks", data_path(0)])
+        self.assertEqual(stderr, "")
+        self.assertEqual(stdout.splitlines()[2],
+                         "# rank\tB/ms\tr2\tfirst\tlast\tcall stack")
+
+        suspects = msparser.leak_suspects(msparser.parse_file(data_path(0)))
+        rows = self.parse_rows(stdout)
+        self.assertEqual(len(rows), len(suspects))
+        self.assertEqual(rows[0], ["  1", "12000", "1.000", "12000", "12000",
+                                   "h (prog.c:4) <- g (prog.c:9)"])
+        for (row, suspect) in zip(rows, suspects):
+            self.assertEqual(float(row[1]), suspect["slope"])
+            self.assertEqual(int(row[4]), suspect["last_nbytes"])
+            self.assertEqual(row[5].split(" <- ")[-1],
+                             msprint.format_details(suspect["details"]))
+
+    def test_no_suspects(self):
+        (stdout, stderr) = run_msprint(["-o", "leaks", data_path(1)])
+        self.assertEqual(stderr, "")
+        self.assertEqual(self.parse_rows(stdout), [])
+
+    def test_merged_suspects(self):
+        # A merged profile has no detailed snapshots, hence no trends.
+        (stdout, stderr) = run_msprint(["--merge", "-o", "leaks",
+                                        data_path(0), data_path(0)])
+        self.assertEqual(stdout, "")
+        self.assertTrue("The leaks output can't be used with --merge !"
+                        in stderr, stderr)
+
+
+class BatchTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.missing = os.path.join(self.directory, "massif.out.missing")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def count_tables(self, stdout):
+        # Each table starts with a header line giving the command.
+        return stdout.count("# valgrind --tool=massif")
+
+    def test_listfile(self):
+        listfile = os.path.join(self.directory, "list")
+        with open(listfile, "w") as fd:
+            fd.write(data_path(2) + "\n\n" + data_path(3) + "\n")
+
+        (options, args) = msprint.parse_args(["-b", listfile, data_path(0)])
+        self.assertEqual(list(msprint.input_paths(options, args)),
+                         [data_path(0), data_path(2), data_path(3)])
+
+        (stdout, stderr) = run_msprint(["-o", "table", "-b", listfile])
+        self.assertEqual(stderr, "")
+        self.assertEqual(self.count_tables(stdout), 2)
+
+    def test_stdin(self):
+        listing = "\n".join([data_path(2), data_path(3), data_path(6)])
+        (stdout, stderr) = run_msprint(["-o", "table", "--batch", "-"],
+                                       listing.encode("ascii"))
+        self.assertEqual(stderr, "")
+        self.assertEqual(self.count_tables(stdout), 3)
+
+    def test_missing_path(self):
+        listing = "\n".join([data_path(2), self.missing, data_path(3)])
+        (stdout, stderr) = run_msprint(["-o", "table", "--batch", "-"],
+                                       listing.encode("ascii"))
+        self.assertEqual(stderr.splitlines(),
+                         ["No such file: " + self.missing])
+        self.assertEqual(self.count_tables(stdout), 2)
+
+
+class GraphvizOutputTest(TestCase):
+    def count_graph_nodes(self, stdout):
+        return len([line for line in stdout.splitlines()
+                    if "[label=" in line])
+
+    def test_snapshot(self):
+        (stdout, stderr) = run_msprint(["-o", "graphviz", "--snapshot", "9",
+                                        data_path(0)])
+        self.assertEqual(stderr, "")
+        self.assertEqual(stdout.splitlines(), [
+            "// msprint.py - (C) Mathieu Turcotte, 2011",
+            "digraph snapshot_9 {",
+            "    node [shape=box];",
+            '    n0 [label="time=184\\n9000 B"];',
+            '    n1 [label="main (prog.c:22)\\n9000 B"];',
+            "    n0 -> n1;",
+            "}"])
+
+    def test_peak_snapshot(self):
+        mdata = msparser.parse_file(data_path(0))
+        peak = mdata["snapshots"][mdata["peak_snapshot_index"]]
+        (stdout, stderr) = run_msprint(["-o", "graphviz", data_path(0)])
+        self.assertEqual(stderr, "")
+        self.assertEqual(stdout.splitlines()[1],
+                         "digraph snapshot_%d {" % peak["id"])
+        self.assertEqual(self.count_graph_nodes(stdout),
+                         count_nodes(peak["heap_tree"]))
+
+    def test_unknown_snapshot(self):
+        (stdout, stderr) = run_msprint(["-o", "graphviz", "--snapshot", "99",
+                                        data_path(0)])
+        self.assertEqual(stdout, "")
+        self.assertEqual(stderr.splitlines(), ["No snapshot 99"])
+
+    def test_snapshot_not_detailed(self):
+        (stdout, stderr) = run_msprint(["-o", "graphviz", "--snapshot", "2",
+                                        data_path(0)])
+        self.assertEqual(stdout, "")
+        self.assertEqual(stderr.splitlines(), ["Snapshot 2 isn't detailed."])
+
+    def test_merged_profile(self):
+        paths = [data_path(i) for i in [2, 3, 6]]
+        heap_tree = msparser.merge(paths)["merged_peak_heap_tree"]
+        (stdout, stderr) = run_msprint(["--merge", "-o", "graphviz"] + paths)
+        self.assertEqual(stderr, "")
+        lines = stdout.splitlines()
+        self.assertEqual(lines[1], "digraph merged_peak {")
+        # The root isn't labelled with a time.
+        self.assertEqual(lines[3], '    n0 [label="merged peak of 3 runs'
+                                   '\\n%d B"];' % heap_tree["nbytes"])
+        self.assertEqual(self.count_graph_nodes(stdout),
+                         count_nodes(heap_tree))
+
+    def test_merged_profile_snapshot(self):
+        (stdout, stderr) = run_msprint(["--merge", "-o", "graphviz",
+                                        "--snapshot", "1", data_path(0)])
+        self.assertEqual(stdout, "")
+        self.assertEqual(stderr.splitlines(), ["Snapshot 1 isn't detailed."])
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,7 @@
 # Copyright (c) 2011 Mathieu Turcotte
 # Licensed under the MIT license.
 
-from distutils.core import setup
+from distutils.core import setup, Extension
 
 
 def read(path):
@@ -10,7 +10,11 @@ def read(path):
 
 setup(
     name="msparser",
-    py_modules=["msparser"],
+    packages=["msparser"],
+    # The native scanner is optional, msparser falls back on its pure Python
+    # implementation when the extension can't be built.
+    ext_modules=[Extension("msparser._speedups", ["msparser/_speedups.c"],
+                           optional=True)],
     version="1.4",
     license="MIT",
     description="Valgrind massif.out parser",